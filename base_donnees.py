@@ -0,0 +1,138 @@
+import glob
+import os
+import pathlib
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from instrumentation import etape
+
+# Réglages des connexions en lecture seule aux bases accidents_{annee}.db
+TAILLE_MMAP = 256 * 1024 * 1024  # octets projetés en mémoire
+TAILLE_CACHE_PAGES_KO = 64 * 1024  # cache de pages par connexion (en Kio)
+TAILLE_CACHE_REQUETES = 64  # requêtes compilées conservées par connexion
+CONNEXIONS_MAX_PAR_BASE = 8
+ATTACHES_MAX = 10  # limite SQLITE_MAX_ATTACHED par défaut
+
+
+# Connexion qui mémorise, pour chaque année, le schéma SQLite où se trouvent ses tables
+# ('main' pour une seule année, une base attachée par année sinon)
+class ConnexionAccidents(sqlite3.Connection):
+    schemas = {}
+
+
+# Fonction pour obtenir le nom du fichier de la base d'une année
+def chemin_base(annee):
+    return f'accidents_{annee}.db'
+
+
+# Fonction pour lister les années dont la base a été importée
+def annees_disponibles():
+    correspondances = (re.fullmatch(r'accidents_(\d{4})\.db', chemin) for chemin in glob.glob('accidents_*.db'))
+    return sorted(int(m.group(1)) for m in correspondances if m)
+
+
+# Fonction pour obtenir l'empreinte (taille, date de modification) des bases de plusieurs années,
+# qui change à chaque réimport
+def empreinte_bases(annees):
+    empreintes = []
+    for annee in sorted(annees):
+        infos = os.stat(chemin_base(annee))
+        empreintes.append((annee, infos.st_size, infos.st_mtime_ns))
+    return tuple(empreintes)
+
+
+# Fonction pour découper une liste d'années en lots attachables à une même connexion
+def decouper_annees(annees):
+    annees = sorted(annees)
+    return [annees[i:i + ATTACHES_MAX] for i in range(0, len(annees), ATTACHES_MAX)]
+
+
+# Fonction pour obtenir l'URI en lecture seule d'une base (les bases ne sont plus modifiées après l'import)
+def uri_lecture_seule(chemin):
+    return pathlib.Path(chemin).absolute().as_uri() + '?mode=ro&immutable=1'
+
+
+# Fonction pour ouvrir une connexion en lecture seule sur une année, ou sur plusieurs années attachées
+def ouvrir_connexion(annees):
+    if len(annees) == 1:
+        conn = sqlite3.connect(uri_lecture_seule(chemin_base(annees[0])), uri=True, check_same_thread=False,
+                               cached_statements=TAILLE_CACHE_REQUETES, factory=ConnexionAccidents)
+        conn.schemas = {annees[0]: 'main'}
+    else:
+        conn = sqlite3.connect(':memory:', uri=True, check_same_thread=False,
+                               cached_statements=TAILLE_CACHE_REQUETES, factory=ConnexionAccidents)
+        conn.schemas = {annee: f'a{annee}' for annee in annees}
+        for annee, schema in conn.schemas.items():
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (uri_lecture_seule(chemin_base(annee)),))
+    for schema in conn.schemas.values():
+        conn.execute(f'PRAGMA {schema}.mmap_size = {TAILLE_MMAP}')
+        conn.execute(f'PRAGMA {schema}.cache_size = -{TAILLE_CACHE_PAGES_KO}')
+    return conn
+
+
+# Fonction pour obtenir les schémas d'une connexion (une connexion sqlite3 ordinaire n'a que la base 'main')
+def schemas_connexion(conn):
+    return list(getattr(conn, 'schemas', {None: 'main'}).values())
+
+
+# Fonction pour répéter une requête sur le schéma de chaque année et en réunir les résultats (UNION ALL)
+def requete_toutes_annees(conn, requete, params=(), **valeurs):
+    requetes = [requete.format(schema=schema, **valeurs) for schema in schemas_connexion(conn)]
+    return '\nUNION ALL\n'.join(requetes), list(params) * len(requetes)
+
+
+# Pool de connexions partagé par toutes les sessions, une file de connexions par année ou groupe d'années
+class GestionnaireConnexions:
+    def __init__(self, connexions_max=CONNEXIONS_MAX_PAR_BASE):
+        self.connexions_max = connexions_max
+        self._pools = {}
+        self._verrou = threading.Lock()
+
+    def _pool(self, annees):
+        # Les dates de modification font partie de la clé : une base réimportée obtient de nouvelles connexions
+        cle = (annees, tuple(os.stat(chemin_base(annee)).st_mtime_ns for annee in annees))
+        with self._verrou:
+            pool = self._pools.get(cle)
+            if pool is None:
+                for ancienne_cle in [c for c in self._pools if c[0] == annees]:
+                    self._vider(self._pools.pop(ancienne_cle))
+                pool = self._pools[cle] = queue.LifoQueue(maxsize=self.connexions_max)
+        return pool
+
+    @staticmethod
+    def _vider(pool):
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @contextmanager
+    def connexion(self, annees):
+        # Emprunter une connexion au pool de l'année ou des années (ou en ouvrir une), puis la rendre après usage
+        annees = (annees,) if isinstance(annees, int) else tuple(sorted(annees))
+        if len(annees) > ATTACHES_MAX:
+            raise ValueError(f"Au plus {ATTACHES_MAX} années par connexion (voir decouper_annees)")
+        with etape('connexion') as mesure:
+            pool = self._pool(annees)
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                conn = ouvrir_connexion(annees)
+                if mesure:
+                    mesure['ouverture'] = True
+        try:
+            yield conn
+        finally:
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def fermer(self):
+        with self._verrou:
+            for pool in self._pools.values():
+                self._vider(pool)
+            self._pools.clear()
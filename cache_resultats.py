@@ -0,0 +1,180 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Limites par défaut du cache partagé des rapports
+TAILLE_MAX_OCTETS = 256 * 1024 * 1024
+ENTREES_MAX = 2000
+DUREE_VIE_SECONDES = 7 * 24 * 3600
+
+
+# Cache LRU des résultats d'analyse, partagé par toutes les sessions, borné en taille, en nombre d'entrées et en durée,
+# avec persistance facultative sur disque (un fichier pickle par clé) pour survivre aux redémarrages
+class CacheResultats:
+    def __init__(self, taille_max_octets=TAILLE_MAX_OCTETS, entrees_max=ENTREES_MAX,
+                 duree_vie=DUREE_VIE_SECONDES, repertoire=None):
+        self.taille_max_octets = taille_max_octets
+        self.entrees_max = entrees_max
+        self.duree_vie = duree_vie
+        self.repertoire = repertoire
+        self._entrees = OrderedDict()  # empreinte de la clé -> (date d'enregistrement, taille, valeur)
+        self._taille = 0
+        self._calculs = {}  # verrou par clé en cours de calcul, pour ne calculer qu'une fois un même rapport
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.echecs = 0
+        self.evictions = 0
+        if repertoire:
+            os.makedirs(repertoire, exist_ok=True)
+            self.elaguer()
+
+    @staticmethod
+    def empreinte(cle):
+        return hashlib.sha256(repr(cle).encode('utf-8')).hexdigest()
+
+    def _fichier(self, empreinte):
+        return os.path.join(self.repertoire, f'{empreinte}.pkl')
+
+    def _retirer(self, empreinte, supprimer_fichier=True):
+        _, taille, _ = self._entrees.pop(empreinte)
+        self._taille -= taille
+        if self.repertoire and supprimer_fichier:
+            try:
+                os.remove(self._fichier(empreinte))
+            except OSError:
+                pass
+
+    def _ajouter(self, empreinte, date, taille, valeur):
+        if empreinte in self._entrees:
+            # Le fichier vient d'être réécrit pour la même clé : le garder
+            self._retirer(empreinte, supprimer_fichier=False)
+        self._entrees[empreinte] = (date, taille, valeur)
+        self._taille += taille
+        # Éviction des entrées les moins récemment utilisées
+        while self._entrees and (len(self._entrees) > self.entrees_max or self._taille > self.taille_max_octets):
+            self._retirer(next(iter(self._entrees)))
+            self.evictions += 1
+
+    def _lire(self, empreinte):
+        # Renvoie (trouvé, valeur) depuis la mémoire, sinon depuis le disque ; à appeler sous self._verrou
+        maintenant = time.time()
+        if empreinte in self._entrees:
+            date, _, valeur = self._entrees[empreinte]
+            if maintenant - date <= self.duree_vie:
+                self._entrees.move_to_end(empreinte)
+                return True, valeur
+            self._retirer(empreinte)
+        if self.repertoire:
+            fichier = self._fichier(empreinte)
+            try:
+                date = os.path.getmtime(fichier)
+                if maintenant - date > self.duree_vie:
+                    os.remove(fichier)
+                    return False, None
+                with open(fichier, 'rb') as f:
+                    donnees = f.read()
+            except OSError:
+                return False, None
+            try:
+                valeur = pickle.loads(donnees)
+            except Exception:
+                return False, None
+            self._ajouter(empreinte, date, len(donnees), valeur)
+            return True, valeur
+        return False, None
+
+    def obtenir(self, cle):
+        with self._verrou:
+            trouve, valeur = self._lire(self.empreinte(cle))
+            if trouve:
+                self.succes += 1
+            else:
+                self.echecs += 1
+            return trouve, valeur
+
+    def enregistrer(self, cle, valeur):
+        empreinte = self.empreinte(cle)
+        donnees = pickle.dumps(valeur, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.repertoire:
+            # Écriture dans un fichier temporaire puis renommage, pour ne jamais lire un fichier incomplet
+            fichier_temporaire = f'{self._fichier(empreinte)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(fichier_temporaire, 'wb') as f:
+                f.write(donnees)
+            os.replace(fichier_temporaire, self._fichier(empreinte))
+        with self._verrou:
+            self._ajouter(empreinte, time.time(), len(donnees), valeur)
+        if self.repertoire:
+            self.elaguer()
+
+    def elaguer(self):
+        # Le répertoire peut contenir des fichiers jamais relus depuis le démarrage, ou écrits par d'autres processus :
+        # supprimer les fichiers expirés (et les fichiers temporaires abandonnés), puis les plus anciens au-delà des limites
+        maintenant = time.time()
+        fichiers = []
+        for nom in os.listdir(self.repertoire):
+            if not nom.endswith(('.pkl', '.tmp')):
+                continue
+            chemin = os.path.join(self.repertoire, nom)
+            try:
+                infos = os.stat(chemin)
+                if maintenant - infos.st_mtime > self.duree_vie:
+                    os.remove(chemin)
+                elif nom.endswith('.pkl'):
+                    fichiers.append((infos.st_mtime, infos.st_size, chemin))
+            except OSError:
+                continue
+        fichiers.sort()
+        taille = sum(taille_fichier for _, taille_fichier, _ in fichiers)
+        while fichiers and (len(fichiers) > self.entrees_max or taille > self.taille_max_octets):
+            _, taille_fichier, chemin = fichiers.pop(0)
+            taille -= taille_fichier
+            try:
+                os.remove(chemin)
+            except OSError:
+                pass
+
+    def obtenir_ou_calculer(self, cle, calculer):
+        empreinte = self.empreinte(cle)
+        with self._verrou:
+            trouve, valeur = self._lire(empreinte)
+            if trouve:
+                self.succes += 1
+                return valeur
+            verrou_calcul = self._calculs.setdefault(empreinte, threading.Lock())
+        # Un seul calcul par clé : les sessions concurrentes attendent puis relisent le résultat
+        with verrou_calcul:
+            with self._verrou:
+                trouve, valeur = self._lire(empreinte)
+                if trouve:
+                    self.succes += 1
+                    return valeur
+                self.echecs += 1
+            try:
+                valeur = calculer()
+                self.enregistrer(cle, valeur)
+            finally:
+                with self._verrou:
+                    self._calculs.pop(empreinte, None)
+        return valeur
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+            self._taille = 0
+        if self.repertoire:
+            for fichier in os.listdir(self.repertoire):
+                if fichier.endswith('.pkl'):
+                    os.remove(os.path.join(self.repertoire, fichier))
+
+    def statistiques(self):
+        with self._verrou:
+            return {
+                'entrees': len(self._entrees),
+                'taille_octets': self._taille,
+                'succes': self.succes,
+                'echecs': self.echecs,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,219 @@
+import math
+import numpy as np
+import pandas as pd
+from base_donnees import decouper_annees, requete_toutes_annees, schemas_connexion
+from instrumentation import lire_requete
+from moteur_analyse import CATV_VELO
+
+# Carte des victimes piétonnes et cyclistes : agrégation en cellules d'une grille côté serveur (le navigateur ne reçoit
+# que les comptes par cellule) et recherche des victimes à moins de N mètres d'un point, à l'aide de l'index spatial
+# (tables coordonnees et index_spatial créées par import_donnees.py)
+
+# Mètres par degré de latitude
+METRES_PAR_DEGRE = 111_320
+RAYON_TERRE_M = 6_371_000
+
+# Nombre de cellules visé sur la plus grande dimension de la carte, et taille minimale d'une cellule
+CELLULES_PAR_COTE = 40
+TAILLE_CELLULE_MIN_M = 50
+
+# Marge ajoutée autour des accidents des communes pour délimiter leur carte
+MARGE_EMPRISE_M = 100
+
+# Distance au point médian des accidents des communes au-delà de laquelle une position est jugée mal géocodée
+# (ex. latitude et longitude inversées), plus grande que l'étendue des communes les plus vastes de métropole
+DISTANCE_MAX_MEDIANE_M = 50_000
+
+# Victimes piétonnes, ou conductrices d'un accident impliquant un vélo (comme la liste détaillée), hors indemnes
+FILTRE_VICTIMES = '''u.grav != 1 AND (u.catu = 3 OR (u.catu = 1 AND EXISTS (
+    SELECT 1 FROM {schema}.vehicules v WHERE v.Num_Acc = u.Num_Acc AND v.catv IN (%s)
+)))''' % ', '.join(str(catv) for catv in CATV_VELO)
+
+# Accidents dont la boîte dans l'index spatial recoupe une emprise (sud, nord, ouest, est)
+FILTRE_EMPRISE = 'r.lat_max >= ? AND r.lat_min <= ? AND r.long_max >= ? AND r.long_min <= ?'
+
+# Comptes de victimes des communes demandées (même filtre que le rapport) par cellule de la grille, type d'usager et
+# gravité, dans une emprise (sud, nord, ouest, est)
+# (les décalages de 90° et 180° gardent des indices de cellule positifs, CAST tronquant vers zéro)
+REQUETE_GRILLE = '''
+SELECT
+    CAST((g.latitude + 90) / ? AS INTEGER) AS ligne,
+    CAST((g.longitude + 180) / ? AS INTEGER) AS colonne,
+    CASE WHEN u.catu = 3 THEN 'Piéton' ELSE 'Cycliste' END AS type_usager,
+    u.grav AS gravite,
+    COUNT(*) AS nombre
+FROM {schema}.index_spatial r
+JOIN {schema}.coordonnees g ON g.Num_Acc = r.id
+JOIN {schema}.caract c ON c.Num_Acc = g.Num_Acc
+JOIN {schema}.usagers u ON u.Num_Acc = c.Num_Acc
+WHERE ''' + FILTRE_EMPRISE + ' AND ' + FILTRE_VICTIMES + ''' AND c.com IN ({marqueurs})
+GROUP BY ligne, colonne, type_usager, gravite
+'''
+
+# Victimes dans une emprise, à filtrer ensuite sur la distance exacte
+REQUETE_VICTIMES_EMPRISE = '''
+SELECT
+    c.Num_Acc,
+    c.com,
+    c.an AS annee,
+    c.mois AS mois,
+    c.jour AS jour,
+    c.adr AS adresse,
+    g.latitude,
+    g.longitude,
+    CASE WHEN u.catu = 3 THEN 'Piéton' ELSE 'Cycliste' END AS type_usager,
+    u.grav AS gravite
+FROM {schema}.index_spatial r
+JOIN {schema}.coordonnees g ON g.Num_Acc = r.id
+JOIN {schema}.caract c ON c.Num_Acc = g.Num_Acc
+JOIN {schema}.usagers u ON u.Num_Acc = c.Num_Acc
+WHERE ''' + FILTRE_EMPRISE + ' AND ' + FILTRE_VICTIMES + '\n'
+
+# Coordonnées des accidents des communes demandées, pour délimiter leur carte
+REQUETE_COORDONNEES_COMMUNES = '''
+SELECT g.latitude, g.longitude
+FROM {schema}.caract c
+JOIN {schema}.coordonnees g ON g.Num_Acc = c.Num_Acc
+WHERE c.com IN ({marqueurs})
+'''
+
+# Accidents des communes demandées dont l'adresse contient un texte, pour situer une rue
+REQUETE_ADRESSE = '''
+SELECT g.latitude, g.longitude
+FROM {schema}.caract c
+JOIN {schema}.coordonnees g ON g.Num_Acc = c.Num_Acc
+WHERE c.com IN ({marqueurs}) AND c.adr LIKE ?
+'''
+
+
+# Fonction pour vérifier si toutes les années d'une connexion ont un index spatial (bases importées avant son ajout)
+def index_spatial_present(conn):
+    return all(conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'index_spatial'").fetchone()
+               for schema in schemas_connexion(conn))
+
+
+# Fonction pour obtenir l'emprise (sud, nord, ouest, est) d'un cercle de rayon donné en mètres
+def emprise_cercle(latitude, longitude, rayon_m):
+    delta_latitude = rayon_m / METRES_PAR_DEGRE
+    delta_longitude = rayon_m / (METRES_PAR_DEGRE * max(math.cos(math.radians(latitude)), 1e-6))
+    return latitude - delta_latitude, latitude + delta_latitude, longitude - delta_longitude, longitude + delta_longitude
+
+
+# Fonction pour calculer la distance en mètres entre un point et des séries de coordonnées (formule de haversine)
+def distances_m(latitude, longitude, latitudes, longitudes):
+    phi1, phi2 = np.radians(latitude), np.radians(latitudes)
+    dphi, dlambda = phi2 - phi1, np.radians(longitudes - longitude)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * RAYON_TERRE_M * np.arcsin(np.sqrt(a))
+
+
+# Fonction pour choisir la taille des cellules (en mètres) couvrant une emprise en CELLULES_PAR_COTE cellules environ
+def taille_cellule(emprise):
+    sud, nord, ouest, est = emprise
+    hauteur = (nord - sud) * METRES_PAR_DEGRE
+    largeur = (est - ouest) * METRES_PAR_DEGRE * math.cos(math.radians((sud + nord) / 2))
+    return max(max(hauteur, largeur) / CELLULES_PAR_COTE, TAILLE_CELLULE_MIN_M)
+
+
+# Fonction pour lire, sur une connexion, les comptes de victimes des communes par cellule d'une grille dans une emprise
+def lire_grille(conn, emprise, codes_insee, pas_latitude, pas_longitude):
+    marqueurs = ', '.join('?' * len(codes_insee))
+    params = [pas_latitude, pas_longitude, *emprise, *(str(code_insee) for code_insee in codes_insee)]
+    requete, params = requete_toutes_annees(conn, REQUETE_GRILLE, params, marqueurs=marqueurs)
+    return lire_requete('grille_victimes', requete, conn, params)
+
+
+# Fonction pour lire, sur une connexion, les victimes d'une emprise
+def lire_victimes_emprise(conn, emprise):
+    requete, params = requete_toutes_annees(conn, REQUETE_VICTIMES_EMPRISE, list(emprise))
+    return lire_requete('victimes_emprise', requete, conn, params)
+
+
+# Fonction pour agréger en grille les victimes des communes dans une emprise sur plusieurs années
+# Renvoie une ligne par cellule non vide : centre (latitude, longitude), victimes, tués et hospitalisés, au total puis
+# par type d'usager (pietons, pietons_tues, ..., cyclistes_hospitalises) ; None si une des bases n'a pas d'index spatial
+def agreger_grille(connexions, annees, codes_insee, emprise, taille_cellule_m=None):
+    taille_cellule_m = taille_cellule_m or taille_cellule(emprise)
+    sud, nord = emprise[:2]
+    pas_latitude = taille_cellule_m / METRES_PAR_DEGRE
+    pas_longitude = taille_cellule_m / (METRES_PAR_DEGRE * max(math.cos(math.radians((sud + nord) / 2)), 1e-6))
+    comptes = []
+    for lot in decouper_annees(annees):
+        with connexions.connexion(lot) as conn:
+            if not index_spatial_present(conn):
+                return None
+            comptes.append(lire_grille(conn, emprise, codes_insee, pas_latitude, pas_longitude))
+    comptes = pd.concat(comptes, ignore_index=True)
+    indicateurs = {}
+    for total, prefixe, usager in (('victimes', '', None), ('pietons', 'pietons_', 'Piéton'),
+                                   ('cyclistes', 'cyclistes_', 'Cycliste')):
+        nombre = comptes['nombre'] if usager is None else comptes['nombre'].where(comptes['type_usager'] == usager, 0)
+        indicateurs[total] = nombre
+        indicateurs[f'{prefixe}tues'] = nombre.where(comptes['gravite'] == 2, 0)
+        indicateurs[f'{prefixe}hospitalises'] = nombre.where(comptes['gravite'] == 3, 0)
+    comptes = comptes.assign(**indicateurs)
+    cellules = comptes.groupby(['ligne', 'colonne'])[list(indicateurs)].sum().reset_index()
+    cellules['latitude'] = (cellules['ligne'] + 0.5) * pas_latitude - 90
+    cellules['longitude'] = (cellules['colonne'] + 0.5) * pas_longitude - 180
+    return cellules.drop(columns=['ligne', 'colonne'])
+
+
+# Fonction pour rechercher, sur plusieurs années et toutes communes confondues, les victimes à moins de rayon_m mètres
+# d'un point, triées par distance (None si une des bases n'a pas d'index spatial)
+def victimes_proches(connexions, annees, latitude, longitude, rayon_m):
+    emprise = emprise_cercle(latitude, longitude, rayon_m)
+    victimes = []
+    for lot in decouper_annees(annees):
+        with connexions.connexion(lot) as conn:
+            if not index_spatial_present(conn):
+                return None
+            victimes.append(lire_victimes_emprise(conn, emprise))
+    victimes = pd.concat(victimes, ignore_index=True)
+    victimes['distance_m'] = distances_m(latitude, longitude, victimes['latitude'], victimes['longitude']).round()
+    return victimes[victimes['distance_m'] <= rayon_m].sort_values(['distance_m', 'Num_Acc']).reset_index(drop=True)
+
+
+# Fonction pour lire les coordonnées des accidents des communes demandées, ou de ceux dont l'adresse contient un texte
+def lire_coordonnees(connexions, annees, codes_insee, adresse=None):
+    marqueurs = ', '.join('?' * len(codes_insee))
+    params = [str(code_insee) for code_insee in codes_insee]
+    if adresse is None:
+        requete_annee = REQUETE_COORDONNEES_COMMUNES
+    else:
+        requete_annee, params = REQUETE_ADRESSE, params + [f'%{adresse}%']
+    coordonnees = []
+    for lot in decouper_annees(annees):
+        with connexions.connexion(lot) as conn:
+            if not index_spatial_present(conn):
+                return None
+            requete, params_annees = requete_toutes_annees(conn, requete_annee, params, marqueurs=marqueurs)
+            coordonnees.append(lire_requete('coordonnees_communes', requete, conn, params_annees))
+    return pd.concat(coordonnees, ignore_index=True)
+
+
+# Fonction pour obtenir l'emprise (sud, nord, ouest, est) des accidents des communes, avec une marge de MARGE_EMPRISE_M
+# mètres ; l'import n'écarte que les coordonnées impossibles, les positions à plus de DISTANCE_MAX_MEDIANE_M du point
+# médian sont donc ignorées ici pour qu'un seul accident mal géocodé n'étende pas la carte (None si aucun n'est géolocalisé)
+def emprise_communes(connexions, annees, codes_insee):
+    coordonnees = lire_coordonnees(connexions, annees, codes_insee)
+    if coordonnees is None or coordonnees.empty:
+        return None
+    distances = distances_m(coordonnees['latitude'].median(), coordonnees['longitude'].median(),
+                            coordonnees['latitude'], coordonnees['longitude'])
+    proches = coordonnees[distances <= DISTANCE_MAX_MEDIANE_M]
+    # Accidents répartis en groupes éloignés (médiane entre eux) : garder toutes les positions
+    coordonnees = proches if not proches.empty else coordonnees
+    sud, nord = coordonnees['latitude'].min(), coordonnees['latitude'].max()
+    ouest, est = coordonnees['longitude'].min(), coordonnees['longitude'].max()
+    marge_latitude = MARGE_EMPRISE_M / METRES_PAR_DEGRE
+    marge_longitude = MARGE_EMPRISE_M / (METRES_PAR_DEGRE * max(math.cos(math.radians((sud + nord) / 2)), 1e-6))
+    return sud - marge_latitude, nord + marge_latitude, ouest - marge_longitude, est + marge_longitude
+
+
+# Fonction pour situer une rue : point médian des accidents des communes dont l'adresse contient le texte
+# Renvoie (latitude, longitude, nombre d'accidents trouvés), ou None
+def situer_adresse(connexions, annees, codes_insee, adresse):
+    coordonnees = lire_coordonnees(connexions, annees, codes_insee, adresse)
+    if coordonnees is None or coordonnees.empty:
+        return None
+    return coordonnees['latitude'].median(), coordonnees['longitude'].median(), len(coordonnees)
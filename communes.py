@@ -0,0 +1,121 @@
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+
+import pandas as pd
+
+FICHIER_COMMUNES = 'v_commune_2024.csv'
+
+# Nombre maximal de résultats proposés par la recherche
+LIMITE_RESULTATS = 50
+
+# Ordre d'affichage des types de communes à pertinence égale (commune, arrondissement, déléguée, associée)
+RANG_TYPECOM = {'COM': 0, 'ARM': 1, 'COMD': 2, 'COMA': 3}
+
+# Début de code INSEE : deux caractères de département (dont 2A/2B), puis jusqu'à trois chiffres
+MOTIF_CODE_INSEE = re.compile(r'(\d|\d[\dab]\d{0,3})')
+
+
+# Fonction pour normaliser un texte de recherche : sans accents, sans casse, ponctuation remplacée par des espaces
+def normaliser(texte):
+    texte = unicodedata.normalize('NFKD', texte)
+    texte = ''.join(caractere for caractere in texte if not unicodedata.combining(caractere)).casefold()
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', texte).split())
+
+
+# Fonction pour découper un texte normalisé en trigrammes
+def trigrammes(texte):
+    return {texte[i:i + 3] for i in range(len(texte) - 2)}
+
+
+# Index de recherche des communes, construit une fois par processus à partir de v_commune_2024.csv
+class IndexCommunes:
+    def __init__(self, communes_df):
+        communes_df = communes_df.fillna('')
+        self.codes = communes_df['COM'].tolist()
+        self.typecoms = communes_df['TYPECOM'].tolist()
+
+        # Communes parentes → communes enfants (arrondissements, communes déléguées ou associées)
+        self.enfants = defaultdict(list)
+        for code, parent in zip(self.codes, communes_df['COMPARENT']):
+            if parent and code != parent and code not in self.enfants[parent]:
+                self.enfants[parent].append(code)
+
+        # Département et région des communes déléguées et associées (vides dans le fichier) : ceux de la commune parente
+        departement_par_code = {code: dep for code, dep in zip(self.codes, communes_df['DEP']) if dep}
+        self.departements = [dep or departement_par_code.get(parent, '')
+                             for dep, parent in zip(communes_df['DEP'], communes_df['COMPARENT'])]
+        region_par_code = {code: reg for code, reg in zip(self.codes, communes_df['REG']) if reg}
+        self.regions = [reg or region_par_code.get(parent, '')
+                        for reg, parent in zip(communes_df['REG'], communes_df['COMPARENT'])]
+        self.libelles = [f"{libelle} ({dep}) - INSEE : {code}"
+                         for libelle, dep, code in zip(communes_df['LIBELLE'], self.departements, self.codes)]
+
+        # Noms normalisés, triés pour la recherche par préfixe, et trigrammes pour la recherche dans le nom
+        self.noms = [normaliser(libelle) for libelle in communes_df['LIBELLE']]
+        self._noms_tries = sorted((nom, i) for i, nom in enumerate(self.noms))
+        self._codes_tries = sorted((code.casefold(), RANG_TYPECOM.get(typecom, len(RANG_TYPECOM)), i)
+                                   for i, (code, typecom) in enumerate(zip(self.codes, self.typecoms)))
+        self._trigrammes = defaultdict(set)
+        for i, nom in enumerate(self.noms):
+            for trigramme in trigrammes(nom):
+                self._trigrammes[trigramme].add(i)
+
+    @classmethod
+    def depuis_fichier(cls, fichier=FICHIER_COMMUNES):
+        return cls(pd.read_csv(fichier, sep=',', dtype=str, encoding='utf-8', quotechar='"'))
+
+    def _ordre(self, i):
+        return RANG_TYPECOM.get(self.typecoms[i], len(RANG_TYPECOM)), len(self.noms[i]), self.noms[i], self.codes[i]
+
+    @staticmethod
+    def _prefixe(tries, prefixe):
+        # tries : tuples (valeur normalisée, ..., indice) triés ; renvoie les indices des valeurs commençant par prefixe
+        debut = bisect.bisect_left(tries, (prefixe,))
+        resultats = []
+        for entree in tries[debut:]:
+            if not entree[0].startswith(prefixe):
+                break
+            resultats.append(entree[-1])
+        return resultats
+
+    def rechercher(self, texte, limite=LIMITE_RESULTATS):
+        # Renvoie les indices des communes correspondant au texte : code INSEE, début du nom, puis nom contenant le texte
+        requete = normaliser(texte)
+        if not requete:
+            return []
+        if MOTIF_CODE_INSEE.fullmatch(requete):
+            return self._prefixe(self._codes_tries, requete)[:limite]
+
+        resultats = sorted(self._prefixe(self._noms_tries, requete), key=self._ordre)
+        if len(resultats) < limite and len(requete) >= 3:
+            candidats = set.intersection(*(self._trigrammes.get(trigramme, set()) for trigramme in trigrammes(requete)))
+            deja_trouves = set(resultats)
+            resultats += sorted((i for i in candidats if i not in deja_trouves and requete in self.noms[i]), key=self._ordre)
+        return resultats[:limite]
+
+    def codes_insee(self, i):
+        # Code de la commune et de ses éventuelles communes enfants (ex. arrondissements de Paris, Lyon, Marseille)
+        return [self.codes[i]] + self.enfants.get(self.codes[i], [])
+
+    def nom(self, i):
+        return self.libelles[i].split(" - ")[0]
+
+    def selectionner(self, departements=None, regions=None, codes=None):
+        # Indices des communes des départements ou des régions demandés (TYPECOM = COM, leurs communes enfants étant
+        # incluses dans leur rapport) et des codes INSEE demandés ; toutes les communes si aucun critère n'est donné
+        departements = {dep.upper() for dep in departements or []}
+        regions = set(regions or [])
+        codes = {code.upper() for code in codes or []}
+        tout = not (departements or regions or codes)
+        selection, codes_vus = [], set()
+        for i in sorted(range(len(self.codes)), key=lambda i: RANG_TYPECOM.get(self.typecoms[i], len(RANG_TYPECOM))):
+            code = self.codes[i]
+            if code in codes_vus:
+                continue
+            if (code in codes or (self.typecoms[i] == 'COM' and (tout or self.departements[i] in departements
+                                                                  or self.regions[i] in regions))):
+                selection.append(i)
+                codes_vus.add(code)
+        return sorted(selection)
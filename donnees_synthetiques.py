@@ -0,0 +1,200 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from communes import FICHIER_COMMUNES
+
+# Jeu de données synthétique au format des fichiers BAAC (caract, lieux, usagers, vehicules-{annee}.csv),
+# déterministe pour une graine donnée, pour mesurer l'import et l'analyse sans les fichiers de data.gouv
+
+# Nombre d'accidents corporels par an (ordre de grandeur des fichiers réels)
+ACCIDENTS_PAR_AN = 55_000
+
+GRAINE = 2024
+
+# Exposant de la loi de Zipf répartissant les accidents entre les communes (quelques grandes villes, beaucoup de villages)
+EXPOSANT_ZIPF = 0.9
+
+# Répartitions observées dans les fichiers réels (valeur: probabilité)
+VEHICULES_PAR_ACCIDENT = {1: 0.35, 2: 0.55, 3: 0.10}
+CATV = {
+    7: 0.58, 10: 0.06, 33: 0.07, 1: 0.06, 80: 0.02, 50: 0.03, 2: 0.02, 30: 0.03, 31: 0.02, 32: 0.01, 34: 0.01,
+    14: 0.01, 15: 0.015, 37: 0.01, 38: 0.005, 17: 0.005, 99: 0.01, 43: 0.01, 60: 0.01, 21: 0.005, 20: 0.005, 0: 0.005,
+}
+GRAV_OCCUPANTS = {1: 0.45, 2: 0.02, 3: 0.13, 4: 0.40}
+GRAV_CYCLISTES = {1: 0.05, 2: 0.03, 3: 0.35, 4: 0.57}
+GRAV_PIETONS = {1: 0.02, 2: 0.05, 3: 0.45, 4: 0.48}
+PASSAGERS_PAR_VEHICULE = 0.25  # moyenne (loi de Poisson)
+PROBABILITE_PIETON = 0.12
+VMA = {30: 0.15, 50: 0.45, 70: 0.1, 80: 0.15, 90: 0.05, 110: 0.04, 130: 0.06}
+VOIES = ['RUE DE LA REPUBLIQUE', 'AVENUE JEAN JAURES', 'BOULEVARD VICTOR HUGO', 'ROUTE NATIONALE 7', 'RUE DU MOULIN',
+         'PLACE DE LA GARE', 'CHEMIN DES VIGNES', 'AVENUE DE LA LIBERATION', 'RUE PASTEUR', 'AUTOROUTE A6']
+
+# Emprise approximative de la métropole, pour placer le centre de chaque commune
+LATITUDES = (42.5, 51.0)
+LONGITUDES = (-4.5, 8.0)
+
+
+# Fonction pour tirer des valeurs selon une répartition {valeur: probabilité}
+def tirer(rng, repartition, taille):
+    valeurs = np.array(list(repartition))
+    probabilites = np.array(list(repartition.values()), dtype=float)
+    return rng.choice(valeurs, size=taille, p=probabilites / probabilites.sum())
+
+
+# Fonction pour obtenir le département d'un code INSEE (colonne dep des fichiers BAAC)
+def departements(codes):
+    codes = pd.Series(codes, dtype=str)
+    return codes.str[:3].where(codes.str.startswith('97'), codes.str[:2])
+
+
+# Fonction pour formater des coordonnées avec une virgule décimale, comme les fichiers sources
+def coordonnees(valeurs):
+    return pd.Series(valeurs).map('{:.7f}'.format).str.replace('.', ',', regex=False)
+
+
+# Communes où sont placés les accidents (communes et arrondissements municipaux, les villes à arrondissements étant
+# remplacées par ceux-ci comme dans les fichiers réels), leur poids et le centre de chacune, identiques d'une année à l'autre
+def preparer_communes(fichier_communes, graine):
+    communes_df = pd.read_csv(fichier_communes, sep=',', dtype=str, encoding='utf-8', quotechar='"').fillna('')
+    arrondissements = communes_df[communes_df['TYPECOM'] == 'ARM']
+    villes_arrondissements = set(arrondissements['COMPARENT'])
+    autres = communes_df[(communes_df['TYPECOM'] == 'COM') & ~communes_df['COM'].isin(villes_arrondissements)]
+    rng = np.random.default_rng(graine)
+    # Rangs de Zipf : les arrondissements en tête, puis les autres communes dans un ordre aléatoire fixe
+    codes = np.concatenate([arrondissements['COM'].to_numpy(), rng.permutation(autres['COM'].to_numpy())])
+    poids = 1 / np.arange(1, len(codes) + 1) ** EXPOSANT_ZIPF
+    centres = pd.DataFrame({
+        'lat': rng.uniform(*LATITUDES, len(codes)),
+        'long': rng.uniform(*LONGITUDES, len(codes)),
+    }, index=codes)
+    return codes, poids / poids.sum(), centres
+
+
+# Fonction pour générer les quatre tables d'une année
+def generer_annee(annee, communes, accidents=ACCIDENTS_PAR_AN, graine=GRAINE):
+    codes, poids, centres = communes
+    rng = np.random.default_rng([graine, annee])
+
+    # caract : un accident par ligne
+    num_acc = annee * 10 ** 8 + np.arange(1, accidents + 1)
+    com = rng.choice(codes, size=accidents, p=poids)
+    dates = pd.Timestamp(annee, 1, 1) + pd.to_timedelta(rng.integers(0, 365, accidents), unit='D')
+    centre = centres.loc[com]
+    caract = pd.DataFrame({
+        'Num_Acc': num_acc,
+        'jour': dates.day,
+        'mois': dates.month,
+        'an': annee,
+        'hrmn': pd.Series(rng.integers(0, 24, accidents)).map('{:02d}'.format) + ':'
+                + pd.Series(rng.integers(0, 60, accidents)).map('{:02d}'.format),
+        'lum': rng.integers(1, 6, accidents),
+        'dep': departements(com),
+        'com': com,
+        'agg': rng.integers(1, 3, accidents),
+        'int': rng.integers(1, 10, accidents),
+        'atm': rng.integers(1, 10, accidents),
+        'col': rng.integers(1, 8, accidents),
+        'adr': pd.Series(rng.integers(1, 200, accidents)).astype(str) + ' ' + rng.choice(VOIES, accidents),
+        'lat': coordonnees(centre['lat'].to_numpy() + rng.normal(0, 0.01, accidents)),
+        'long': coordonnees(centre['long'].to_numpy() + rng.normal(0, 0.01, accidents)),
+    })
+
+    # lieux : une ligne par accident
+    lieux = pd.DataFrame({
+        'Num_Acc': num_acc,
+        'catr': rng.integers(1, 8, accidents),
+        'voie': rng.integers(1, 1000, accidents).astype(str),
+        'v1': '', 'v2': '',
+        'circ': rng.integers(1, 5, accidents),
+        'nbv': rng.integers(1, 5, accidents),
+        'vosp': rng.integers(0, 4, accidents),
+        'prof': rng.integers(1, 5, accidents),
+        'pr': '', 'pr1': '',
+        'plan': rng.integers(1, 5, accidents),
+        'lartpc': '', 'larrout': '',
+        'surf': rng.integers(1, 10, accidents),
+        'infra': rng.integers(0, 10, accidents),
+        'situ': rng.integers(1, 9, accidents),
+        'vma': tirer(rng, VMA, accidents),
+    })
+
+    # vehicules : 1 à 3 véhicules par accident (A01, B01, C01)
+    nombre_vehicules = tirer(rng, VEHICULES_PAR_ACCIDENT, accidents)
+    accident_vehicule = np.repeat(np.arange(accidents), nombre_vehicules)
+    rang_vehicule = np.arange(len(accident_vehicule)) - np.repeat(np.cumsum(nombre_vehicules) - nombre_vehicules, nombre_vehicules)
+    num_veh = pd.Series(np.array(list('ABC'))[rang_vehicule]) + '01'
+    catv = tirer(rng, CATV, len(accident_vehicule))
+    id_vehicule = pd.Series(annee * 10 ** 7 + np.arange(len(accident_vehicule))).astype(str)
+    vehicules = pd.DataFrame({
+        'Num_Acc': num_acc[accident_vehicule],
+        'id_vehicule': id_vehicule,
+        'num_veh': num_veh,
+        'senc': rng.integers(0, 3, len(accident_vehicule)),
+        'catv': pd.Series(catv).map('{:02d}'.format),
+        'obs': rng.integers(0, 17, len(accident_vehicule)),
+        'obsm': rng.integers(0, 3, len(accident_vehicule)),
+        'choc': rng.integers(0, 10, len(accident_vehicule)),
+        'manv': rng.integers(0, 27, len(accident_vehicule)),
+        'motor': rng.integers(0, 6, len(accident_vehicule)),
+        'occutc': '',
+    })
+
+    # usagers : un conducteur par véhicule, des passagers, et parfois un piéton heurté par le premier véhicule
+    velo = np.isin(catv, [1, 80])
+    passagers = rng.poisson(PASSAGERS_PAR_VEHICULE, len(accident_vehicule)) * ~velo
+    vehicule_usager = np.concatenate([np.arange(len(accident_vehicule)), np.repeat(np.arange(len(accident_vehicule)), passagers)])
+    catu = np.concatenate([np.ones(len(accident_vehicule), dtype=int), np.full(passagers.sum(), 2)])
+    grav = np.where(velo[vehicule_usager] & (catu == 1), tirer(rng, GRAV_CYCLISTES, len(catu)), tirer(rng, GRAV_OCCUPANTS, len(catu)))
+    pietons = np.flatnonzero((rang_vehicule == 0) & (rng.random(len(accident_vehicule)) < PROBABILITE_PIETON))
+    vehicule_usager = np.concatenate([vehicule_usager, pietons])
+    catu = np.concatenate([catu, np.full(len(pietons), 3)])
+    grav = np.concatenate([grav, tirer(rng, GRAV_PIETONS, len(pietons))])
+    nombre_usagers = len(vehicule_usager)
+    # Âges : un quart de moins de 18 ans
+    ages = np.where(rng.random(nombre_usagers) < 0.25, rng.integers(4, 18, nombre_usagers), rng.integers(18, 90, nombre_usagers))
+    pieton = catu == 3
+    usagers = pd.DataFrame({
+        'Num_Acc': num_acc[accident_vehicule[vehicule_usager]],
+        'id_usager': pd.Series(annee * 10 ** 7 + np.arange(nombre_usagers)).astype(str),
+        'id_vehicule': id_vehicule.to_numpy()[vehicule_usager],
+        'num_veh': num_veh.to_numpy()[vehicule_usager],
+        'place': np.where(catu == 1, 1, np.where(pieton, 10, rng.integers(2, 10, nombre_usagers))),
+        'catu': catu,
+        'grav': grav,
+        'sexe': rng.integers(1, 3, nombre_usagers),
+        'an_nais': annee - ages,
+        'trajet': rng.integers(0, 10, nombre_usagers),
+        'secu1': rng.integers(0, 10, nombre_usagers),
+        'secu2': rng.integers(-1, 10, nombre_usagers),
+        'secu3': -1,
+        'locp': np.where(pieton, rng.integers(0, 10, nombre_usagers), -1),
+        'actp': np.where(pieton, rng.integers(0, 10, nombre_usagers).astype(str), '-1'),
+        'etatp': np.where(pieton, rng.integers(1, 4, nombre_usagers), -1),
+    }).sort_values(['Num_Acc', 'num_veh'], kind='stable')
+
+    return {'caract': caract, 'lieux': lieux, 'usagers': usagers, 'vehicules': vehicules}
+
+
+# Fonction pour écrire les fichiers {table}-{annee}.csv de plusieurs années dans un répertoire
+def generer(annees, repertoire='.', accidents=ACCIDENTS_PAR_AN, graine=GRAINE, fichier_communes=FICHIER_COMMUNES):
+    os.makedirs(repertoire, exist_ok=True)
+    communes = preparer_communes(fichier_communes, graine)
+    for annee in annees:
+        for table, df in generer_annee(annee, communes, accidents, graine).items():
+            df.to_csv(os.path.join(repertoire, f'{table}-{annee}.csv'), sep=';', index=False, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Génère des fichiers BAAC synthétiques (caract, lieux, usagers, vehicules-{annee}.csv)")
+    parser.add_argument('annees', nargs='*', type=int, default=list(range(2020, 2025)), help="années à générer (par défaut 2020 à 2024)")
+    parser.add_argument('--accidents', type=int, default=ACCIDENTS_PAR_AN, help=f"accidents par an (par défaut {ACCIDENTS_PAR_AN})")
+    parser.add_argument('--graine', type=int, default=GRAINE, help=f"graine du générateur aléatoire (par défaut {GRAINE})")
+    parser.add_argument('--sortie', default='.', help="répertoire des fichiers (par défaut : répertoire courant)")
+    parser.add_argument('--communes', default=FICHIER_COMMUNES, help=f"fichier des communes (par défaut {FICHIER_COMMUNES})")
+    args = parser.parse_args()
+
+    debut = time.perf_counter()
+    generer(args.annees, args.sortie, args.accidents, args.graine, args.communes)
+    print(f"{len(args.annees)} année(s) de {args.accidents} accidents générées dans {args.sortie} en {time.perf_counter() - debut:.1f} s")
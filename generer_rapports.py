@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from base_donnees import GestionnaireConnexions, annees_disponibles
+from communes import FICHIER_COMMUNES, IndexCommunes
+from instrumentation import FICHIER_METRIQUES, instrumenter
+from rapport_commune import analyser_accidents_commune, exporter_csv, libelle_periode
+from stockage_parquet import SourceParquet
+
+# Communes envoyées à la fois à chaque processus
+TAILLE_PAQUET = 32
+
+# Nombre de communes traitées entre deux lignes de progression
+INTERVALLE_PROGRESSION = 500
+
+# Pool de connexions (ou source Parquet) propre à chaque processus du générateur (initialisé par initialiser_processus)
+connexions = None
+
+
+# Fonction exécutée au démarrage de chaque processus : ses connexions aux bases annuelles ne sont pas partagées
+def initialiser_processus(repertoire_parquet=None):
+    global connexions
+    connexions = SourceParquet(repertoire_parquet) if repertoire_parquet else GestionnaireConnexions()
+
+
+# Fonction pour obtenir les fichiers Markdown et CSV du rapport d'une commune pour une période
+def chemins_rapport(sortie, periode, departement, code):
+    repertoire = os.path.join(sortie, periode, departement or 'inconnu')
+    return os.path.join(repertoire, f'{code}.md'), os.path.join(repertoire, f'accidents_{code}_{periode}.csv')
+
+
+# Fonction pour écrire un fichier dans un fichier temporaire puis le renommer, pour ne jamais laisser de fichier incomplet
+def ecrire_fichier(chemin, donnees):
+    fichier_temporaire = f'{chemin}.{os.getpid()}.tmp'
+    with open(fichier_temporaire, 'wb') as f:
+        f.write(donnees)
+    os.replace(fichier_temporaire, chemin)
+
+
+# Fonction pour générer le rapport d'une commune (une tâche du pool)
+# Le Markdown est écrit en dernier : sa présence indique que la commune est terminée, pour reprendre un lot interrompu
+# Renvoie (code, message d'erreur ou None)
+def generer_rapport(tache):
+    code, nom_commune, codes_insee, annees, chemin_markdown, chemin_csv = tache
+    try:
+        os.makedirs(os.path.dirname(chemin_markdown), exist_ok=True)
+        # Étapes mesurées et ajoutées au fichier de métriques s'il est défini (variable d'environnement FICHIER_METRIQUES)
+        with instrumenter('rapport_lot', actif=FICHIER_METRIQUES is not None, commune=code, periode=libelle_periode(annees)):
+            ecrire_fichier(chemin_csv, exporter_csv(connexions, codes_insee, annees))
+            rapport = analyser_accidents_commune(connexions, nom_commune, codes_insee, annees)
+            ecrire_fichier(chemin_markdown, rapport.encode('utf-8'))
+    except Exception as e:
+        return code, f"{type(e).__name__}: {e}"
+    return code, None
+
+
+# Fonction pour préparer les tâches d'une période, sans les communes dont le rapport existe déjà (sauf si forcer vaut True)
+def preparer_taches(index_communes, selection, annees, sortie, forcer=False):
+    periode = libelle_periode(annees)
+    taches, deja_faites = [], 0
+    for i in selection:
+        code = index_communes.codes[i]
+        chemin_markdown, chemin_csv = chemins_rapport(sortie, periode, index_communes.departements[i], code)
+        if not forcer and os.path.exists(chemin_markdown):
+            deja_faites += 1
+            continue
+        taches.append((code, index_communes.nom(i), index_communes.codes_insee(i), annees, chemin_markdown, chemin_csv))
+    return taches, deja_faites
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Génère les rapports Markdown et CSV des communes d'un département, "
+                                                 "d'une région, d'une liste de codes INSEE ou de toute la France")
+    parser.add_argument('annees', nargs='*', type=int, help="années à analyser (par défaut toutes les bases importées)")
+    parser.add_argument('--dep', nargs='+', default=[], help="codes des départements (ex. 69 2A 971)")
+    parser.add_argument('--reg', nargs='+', default=[], help="codes des régions (ex. 84)")
+    parser.add_argument('--codes', nargs='+', default=[], help="codes INSEE des communes")
+    parser.add_argument('--periode', action='store_true', help="un seul rapport sur toute la période plutôt qu'un rapport par année")
+    parser.add_argument('--sortie', default='rapports', help="répertoire des rapports (par défaut : rapports)")
+    parser.add_argument('--communes', default=FICHIER_COMMUNES, help=f"fichier des communes (par défaut {FICHIER_COMMUNES})")
+    parser.add_argument('--processus', type=int, default=os.cpu_count(), help="nombre de processus (par défaut : nombre de cœurs)")
+    parser.add_argument('--forcer', action='store_true', help="régénérer les rapports déjà présents")
+    parser.add_argument('--parquet', metavar='REPERTOIRE', help="lire les tables Parquet exportées dans ce répertoire "
+                                                                "plutôt que les bases SQLite (nécessite pyarrow)")
+    args = parser.parse_args()
+
+    if args.parquet:
+        annees_importees = SourceParquet(args.parquet).annees()
+    else:
+        annees_importees = annees_disponibles()
+    annees = sorted(args.annees) or annees_importees
+    manquantes = [annee for annee in annees if annee not in annees_importees]
+    if not annees or manquantes:
+        parser.error(f"Données absentes pour les années {manquantes} (lancer import_donnees.py)" if manquantes
+                     else "Aucune année importée (lancer import_donnees.py)")
+
+    index_communes = IndexCommunes.depuis_fichier(args.communes)
+    selection = index_communes.selectionner(args.dep, args.reg, args.codes)
+    periodes = [annees] if args.periode else [[annee] for annee in annees]
+    taches, deja_faites = [], 0
+    for annees_periode in periodes:
+        taches_periode, deja_faites_periode = preparer_taches(index_communes, selection, annees_periode, args.sortie, args.forcer)
+        taches += taches_periode
+        deja_faites += deja_faites_periode
+    print(f"{len(selection)} communes × {len(periodes)} période(s) : {len(taches)} rapports à générer, {deja_faites} déjà présents")
+
+    # Les communes sont indépendantes : chaque processus lit les bases en lecture seule avec ses propres connexions
+    debut = time.perf_counter()
+    generes, erreurs = 0, []
+    with ProcessPoolExecutor(max_workers=max(args.processus, 1), initializer=initialiser_processus,
+                             initargs=(args.parquet,)) as executor:
+        for numero, (code, erreur) in enumerate(executor.map(generer_rapport, taches, chunksize=TAILLE_PAQUET), start=1):
+            if erreur is None:
+                generes += 1
+            else:
+                erreurs.append(code)
+                print(f"Erreur pour la commune {code} : {erreur}")
+            if numero % INTERVALLE_PROGRESSION == 0 or numero == len(taches):
+                duree = time.perf_counter() - debut
+                debit = numero / max(duree, 1e-9)
+                print(f"  {numero}/{len(taches)} rapports en {duree:.1f} s ({debit:.1f} rapports/s, "
+                      f"reste environ {(len(taches) - numero) / max(debit, 1e-9):.0f} s)")
+
+    duree = time.perf_counter() - debut
+    print(f"{generes} rapports générés dans {args.sortie} en {duree:.1f} s ({generes / max(duree, 1e-9):.1f} rapports/s), "
+          f"{deja_faites} déjà présents, {len(erreurs)} erreur(s)")
+    if erreurs:
+        print(f"Communes en erreur (relancer la même commande pour les reprendre) : {' '.join(erreurs)}")
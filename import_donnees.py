@@ -1,32 +1,311 @@
+import argparse
+import collections
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import sqlite3
+from base_donnees import chemin_base
+from moteur_analyse import COLONNES_STATISTIQUES, calculer_statistiques, charger_lignes
+from stockage_parquet import annee_presente, exporter_annee
 
-for annee in range(2020, 2025):
+# Types déclarés des colonnes connues des fichiers BAAC (les colonnes absentes d'une année restent à NULL,
+# les colonnes inconnues sont créées en TEXT)
+SCHEMA = {
+    'caract': {
+        'Num_Acc': 'INTEGER PRIMARY KEY', 'jour': 'INTEGER', 'mois': 'INTEGER', 'an': 'INTEGER', 'hrmn': 'TEXT',
+        'lum': 'INTEGER', 'dep': 'TEXT', 'com': 'TEXT', 'agg': 'INTEGER', 'int': 'INTEGER', 'atm': 'INTEGER',
+        'col': 'INTEGER', 'adr': 'TEXT', 'lat': 'TEXT', 'long': 'TEXT',
+    },
+    'lieux': {
+        'Num_Acc': 'INTEGER NOT NULL', 'catr': 'INTEGER', 'voie': 'TEXT', 'v1': 'TEXT', 'v2': 'TEXT', 'circ': 'INTEGER',
+        'nbv': 'INTEGER', 'vosp': 'INTEGER', 'prof': 'INTEGER', 'pr': 'TEXT', 'pr1': 'TEXT', 'plan': 'INTEGER',
+        'lartpc': 'TEXT', 'larrout': 'TEXT', 'surf': 'INTEGER', 'infra': 'INTEGER', 'situ': 'INTEGER', 'vma': 'INTEGER',
+    },
+    'usagers': {
+        'Num_Acc': 'INTEGER NOT NULL', 'id_usager': 'TEXT', 'id_vehicule': 'TEXT', 'num_veh': 'TEXT', 'place': 'INTEGER',
+        'catu': 'INTEGER', 'grav': 'INTEGER', 'sexe': 'INTEGER', 'an_nais': 'INTEGER', 'trajet': 'INTEGER',
+        'secu1': 'INTEGER', 'secu2': 'INTEGER', 'secu3': 'INTEGER', 'locp': 'INTEGER', 'actp': 'TEXT', 'etatp': 'INTEGER',
+    },
+    'vehicules': {
+        'Num_Acc': 'INTEGER NOT NULL', 'id_vehicule': 'TEXT', 'num_veh': 'TEXT', 'senc': 'INTEGER', 'catv': 'INTEGER',
+        'obs': 'INTEGER', 'obsm': 'INTEGER', 'choc': 'INTEGER', 'manv': 'INTEGER', 'motor': 'INTEGER', 'occutc': 'INTEGER',
+    },
+}
+
+# Types pandas compacts pour la lecture par lots (codes en petits entiers, codes géographiques en catégories) ;
+# les autres colonnes sont lues en texte
+DTYPES = collections.defaultdict(lambda: str, {
+    'Num_Acc': 'int64', 'jour': 'Int8', 'mois': 'Int8', 'an': 'Int16', 'lum': 'Int8', 'dep': 'category',
+    'com': 'category', 'agg': 'Int8', 'int': 'Int8', 'atm': 'Int8', 'col': 'Int8',
+    'catr': 'Int8', 'circ': 'Int8', 'vosp': 'Int8', 'prof': 'Int8', 'plan': 'Int8', 'surf': 'Int8', 'infra': 'Int8',
+    'situ': 'Int8', 'vma': 'Int16',
+    'num_veh': 'category', 'place': 'Int8', 'catu': 'Int8', 'grav': 'Int8', 'sexe': 'Int8', 'an_nais': 'Int16',
+    'trajet': 'Int8', 'secu1': 'Int8', 'secu2': 'Int8', 'secu3': 'Int8', 'locp': 'Int8', 'etatp': 'Int8',
+    'senc': 'Int8', 'catv': 'Int8', 'obs': 'Int8', 'obsm': 'Int8', 'choc': 'Int8', 'manv': 'Int8', 'motor': 'Int8',
+    'occutc': 'Int16',
+})
+
+# Nombre de lignes lues et écrites à la fois
+TAILLE_LOT = 50_000
+
+# Nombre de communes dont les compteurs sont calculés à la fois (borne la mémoire du précalcul)
+COMMUNES_PAR_LOT_STATISTIQUES = 200
+
+# Réglages SQLite pour le chargement en masse (la base est reconstruite entièrement à chaque import)
+PRAGMAS_IMPORT = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': -256 * 1024,
+}
+
+# Version du contenu des bases (tables, index, statistiques précalculées), enregistrée dans PRAGMA user_version :
+# à incrémenter à chaque changement de ce que produit l'import, pour que les bases existantes soient reconstruites
+VERSION_SCHEMA = 1
+
+# Manifeste des fichiers sources d'une base, pour ne réimporter que les années dont les fichiers ont changé
+SCHEMA_MANIFESTE = '"fichier" TEXT PRIMARY KEY, "taille" INTEGER NOT NULL, "mtime_ns" INTEGER NOT NULL, "empreinte" TEXT NOT NULL'
+
+# Index utilisés par les requêtes de analyse_accidents.py (filtre sur la commune, jointures sur Num_Acc/num_veh)
+INDEX = {
+    'idx_caract_com': ('caract', ['com']),
+    'idx_lieux_num_acc': ('lieux', ['Num_Acc']),
+    'idx_usagers_acc_veh': ('usagers', ['Num_Acc', 'num_veh']),
+    'idx_vehicules_acc_veh': ('vehicules', ['Num_Acc', 'num_veh']),
+}
+
+# Tables de statistiques précalculées par commune, lues par analyse_accidents.py à la place des tables détaillées
+SCHEMA_STATISTIQUES = {
+    'stats_commune': '"annee" INTEGER NOT NULL, "com" TEXT NOT NULL, '
+                     + ''.join(f'"{colonne}" INTEGER NOT NULL, ' for colonne in COLONNES_STATISTIQUES)
+                     + 'PRIMARY KEY ("com", "annee")',
+    'stats_vehicules': '"annee" INTEGER NOT NULL, "com" TEXT NOT NULL, "usager" TEXT NOT NULL, "catv" INTEGER NOT NULL, '
+                       '"nombre" INTEGER NOT NULL, PRIMARY KEY ("com", "annee", "usager", "catv")',
+}
+
+# Coordonnées numériques des accidents (les fichiers sources les écrivent en texte avec une virgule décimale), et index
+# spatial R*Tree sur ces coordonnées (une boîte réduite à un point par accident, id = Num_Acc), lus par carte.py
+SCHEMA_COORDONNEES = '"Num_Acc" INTEGER PRIMARY KEY, "latitude" REAL NOT NULL, "longitude" REAL NOT NULL'
+COLONNES_INDEX_SPATIAL = 'id, lat_min, lat_max, long_min, long_max'
+
+REQUETE_COORDONNEES = '''
+INSERT INTO coordonnees (Num_Acc, latitude, longitude)
+SELECT Num_Acc, latitude, longitude FROM (
+    SELECT Num_Acc,
+           CAST(REPLACE(TRIM(lat), ',', '.') AS REAL) AS latitude,
+           CAST(REPLACE(TRIM(long), ',', '.') AS REAL) AS longitude
+    FROM caract
+    WHERE TRIM(lat) != '' AND TRIM(long) != ''
+)
+WHERE latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180 AND NOT (latitude = 0 AND longitude = 0)
+'''
+
+# Certaines années renomment l'identifiant d'accident (ex. 2022 : Accident_Id)
+RENOMMAGES = {'Accident_Id': 'Num_Acc'}
+
+
+# Fonction pour créer une table typée à partir du schéma et des colonnes du fichier CSV
+def creer_table(conn, table, colonnes_csv):
+    colonnes = dict(SCHEMA[table])
+    for colonne in colonnes_csv:
+        colonnes.setdefault(colonne, 'TEXT')
+    definition = ', '.join(f'"{nom}" {type_sql}' for nom, type_sql in colonnes.items())
+    conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+    conn.execute(f'CREATE TABLE "{table}" ({definition})')
+
+
+# Fonction pour créer les index
+def creer_index(conn):
+    for nom, (table, colonnes) in INDEX.items():
+        liste_colonnes = ', '.join(f'"{colonne}"' for colonne in colonnes)
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {nom} ON "{table}" ({liste_colonnes})')
+
+
+# Fonction pour précalculer les compteurs du rapport de chaque commune (stats_commune et stats_vehicules)
+# Les compteurs étant par commune, ils sont calculés par lots de communes : seules les lignes d'un lot sont en mémoire
+def creer_statistiques(conn):
+    for table, definition in SCHEMA_STATISTIQUES.items():
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f'CREATE TABLE "{table}" ({definition})')
+    communes = [com for com, in conn.execute('SELECT DISTINCT com FROM caract WHERE com IS NOT NULL ORDER BY com')]
+    for debut in range(0, len(communes), COMMUNES_PAR_LOT_STATISTIQUES):
+        lignes = charger_lignes(conn, communes[debut:debut + COMMUNES_PAR_LOT_STATISTIQUES])
+        if lignes.empty:
+            continue
+        statistiques, vehicules = calculer_statistiques(lignes)
+        inserer_lignes(conn, 'stats_commune', statistiques)
+        inserer_lignes(conn, 'stats_vehicules', vehicules)
+
+
+# Fonction pour créer la table des coordonnées numériques et l'index spatial
+# (table ordinaire indexée sur la latitude si SQLite a été compilé sans le module R*Tree : les requêtes restent les mêmes)
+def creer_index_spatial(conn):
+    for table in ('coordonnees', 'index_spatial'):
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+    conn.execute(f'CREATE TABLE coordonnees ({SCHEMA_COORDONNEES})')
+    conn.execute(REQUETE_COORDONNEES)
     try:
-        # 1. Lire les fichiers CSV avec l'année dynamique
-        caract = pd.read_csv(f'caract-{annee}.csv', sep=';', encoding='utf-8')
-        lieux = pd.read_csv(f'lieux-{annee}.csv', sep=';', encoding='utf-8')
-        usagers = pd.read_csv(f'usagers-{annee}.csv', sep=';', encoding='utf-8')
-        vehicules = pd.read_csv(f'vehicules-{annee}.csv', sep=';', encoding='utf-8')
-
-        # 2. Connexion à la base SQLite avec un nom dynamique
-        db_name = f'accidents_{annee}.db'
-        conn = sqlite3.connect(db_name)
-
-        # 3. Écrire chaque DataFrame dans une table SQLite
-        caract.to_sql('caract', conn, if_exists='replace', index=False)
-        lieux.to_sql('lieux', conn, if_exists='replace', index=False)
-        usagers.to_sql('usagers', conn, if_exists='replace', index=False)
-        vehicules.to_sql('vehicules', conn, if_exists='replace', index=False)
-
-        print(f"Données pour l'année {annee} importées avec succès dans {db_name}")
-
-    except FileNotFoundError as e:
-        print(f"Erreur: Fichier non trouvé pour l'année {annee}: {e}")
-    except Exception as e:
-        print(f"Erreur lors du traitement de l'année {annee}: {e}")
+        conn.execute(f'CREATE VIRTUAL TABLE index_spatial USING rtree({COLONNES_INDEX_SPATIAL})')
+    except sqlite3.OperationalError:
+        conn.execute('CREATE TABLE index_spatial ("id" INTEGER PRIMARY KEY, "lat_min" REAL, "lat_max" REAL, "long_min" REAL, "long_max" REAL)')
+        conn.execute('CREATE INDEX idx_index_spatial_lat ON index_spatial ("lat_min")')
+    conn.execute(f'INSERT INTO index_spatial ({COLONNES_INDEX_SPATIAL}) SELECT Num_Acc, latitude, latitude, longitude, longitude FROM coordonnees')
+
+
+# Fonction pour insérer les lignes d'un DataFrame dans une table existante (executemany, dans la transaction en cours)
+def inserer_lignes(conn, table, df):
+    liste_colonnes = ', '.join(f'"{colonne}"' for colonne in df.columns)
+    marqueurs = ', '.join('?' * len(df.columns))
+    # Valeurs manquantes (NaN, <NA>) converties en None pour SQLite
+    df = df.astype(object).where(df.notna(), None)
+    conn.executemany(f'INSERT INTO "{table}" ({liste_colonnes}) VALUES ({marqueurs})', df.itertuples(index=False, name=None))
+
+
+# Fonction pour charger un fichier CSV par lots dans sa table, sans le lire entièrement en mémoire
+def charger_table(conn, table, fichier, taille_lot=TAILLE_LOT):
+    noms_csv = pd.read_csv(fichier, sep=';', encoding='utf-8', nrows=0).columns
+    colonnes = [RENOMMAGES.get(nom, nom) for nom in noms_csv]
+    creer_table(conn, table, colonnes)
+    dtypes = {nom: DTYPES[colonne] for nom, colonne in zip(noms_csv, colonnes)}
+    nombre_lignes = 0
+    for lot in pd.read_csv(fichier, sep=';', encoding='utf-8', dtype=dtypes, chunksize=taille_lot):
+        lot.columns = colonnes
+        inserer_lignes(conn, table, lot)
+        nombre_lignes += len(lot)
+    return nombre_lignes
+
+
+# Fonction pour calculer l'empreinte SHA-256 d'un fichier, lu par blocs
+def calculer_empreinte(fichier):
+    empreinte = hashlib.sha256()
+    with open(fichier, 'rb') as f:
+        for bloc in iter(lambda: f.read(1024 * 1024), b''):
+            empreinte.update(bloc)
+    return empreinte.hexdigest()
+
+
+# Fonction pour lire le manifeste d'une base existante ({fichier: (taille, mtime_ns, empreinte)})
+# (vide si la base a été importée par une version dont le schéma diffère de VERSION_SCHEMA)
+def lire_manifeste(db_name):
+    if not os.path.exists(db_name):
+        return {}
+    conn = sqlite3.connect(db_name)
+    try:
+        if conn.execute('PRAGMA user_version').fetchone()[0] != VERSION_SCHEMA:
+            return {}
+        return {fichier: (taille, mtime_ns, empreinte)
+                for fichier, taille, mtime_ns, empreinte in conn.execute('SELECT * FROM manifeste')}
+    except sqlite3.OperationalError:
+        # Base importée avant l'ajout du manifeste
+        return {}
     finally:
-        # 4. Fermer la connexion si elle existe
-        if 'conn' in locals():
-            conn.close()
+        conn.close()
+
+
+# Fonction pour vérifier si une base a été importée à partir des fichiers actuels
+# (la taille et la date suffisent quand elles n'ont pas bougé, sinon on compare les empreintes)
+def base_a_jour(db_name, fichiers):
+    manifeste = lire_manifeste(db_name)
+    if set(manifeste) != set(fichiers):
+        return False
+    for fichier in fichiers:
+        taille, mtime_ns, empreinte = manifeste[fichier]
+        infos = os.stat(fichier)
+        if infos.st_size != taille:
+            return False
+        if infos.st_mtime_ns != mtime_ns and calculer_empreinte(fichier) != empreinte:
+            return False
+    return True
+
+
+# Fonction pour enregistrer le manifeste des fichiers sources et la version du schéma dans la base
+def ecrire_manifeste(conn, fichiers):
+    conn.execute(f'PRAGMA user_version = {VERSION_SCHEMA}')
+    conn.execute(f'CREATE TABLE manifeste ({SCHEMA_MANIFESTE})')
+    for fichier in fichiers:
+        infos = os.stat(fichier)
+        conn.execute('INSERT INTO manifeste VALUES (?, ?, ?, ?)', (fichier, infos.st_size, infos.st_mtime_ns, calculer_empreinte(fichier)))
+
+
+# Fonction pour importer les quatre fichiers d'une année dans accidents_{annee}.db, et les exporter en Parquet
+# dans repertoire_parquet s'il est donné
+# Renvoie False si la base était déjà à jour (sauf si forcer vaut True)
+def importer_annee(annee, taille_lot=TAILLE_LOT, forcer=False, repertoire_parquet=None):
+    # 1. Vérifier la présence des fichiers CSV et comparer au manifeste avant de toucher à la base
+    fichiers = {table: f'{table}-{annee}.csv' for table in SCHEMA}
+    for fichier in fichiers.values():
+        open(fichier, 'rb').close()
+    db_name = chemin_base(annee)
+    if not forcer and base_a_jour(db_name, fichiers.values()):
+        if repertoire_parquet and not annee_presente(repertoire_parquet, annee):
+            exporter_annee(db_name, repertoire_parquet, annee, taille_lot)
+        return False
+
+    # 2. Construire la base dans un fichier temporaire, réglé pour le chargement en masse : la base en service
+    # n'est remplacée qu'une fois l'import terminé
+    db_temporaire = f'{db_name}.tmp'
+    if os.path.exists(db_temporaire):
+        os.remove(db_temporaire)
+    conn = sqlite3.connect(db_temporaire, isolation_level=None)
+    try:
+        for pragma, valeur in PRAGMAS_IMPORT.items():
+            conn.execute(f'PRAGMA {pragma} = {valeur}')
+
+        # 3. Créer les tables typées et y écrire chaque fichier par lots, dans une seule transaction
+        conn.execute('BEGIN')
+        for table, fichier in fichiers.items():
+            debut = time.perf_counter()
+            nombre_lignes = charger_table(conn, table, fichier, taille_lot)
+            duree = time.perf_counter() - debut
+            print(f"  {annee} {table} : {nombre_lignes} lignes en {duree:.1f} s ({nombre_lignes / max(duree, 1e-9):.0f} lignes/s)")
+
+        # 4. Créer les index et l'index spatial, précalculer les statistiques par commune, enregistrer le manifeste
+        # et lancer ANALYZE
+        creer_index(conn)
+        creer_index_spatial(conn)
+        creer_statistiques(conn)
+        ecrire_manifeste(conn, fichiers.values())
+        conn.execute('COMMIT')
+        conn.execute('ANALYZE')
+    except BaseException:
+        conn.close()
+        os.remove(db_temporaire)
+        raise
+    conn.close()
+    os.replace(db_temporaire, db_name)
+
+    # 5. Exporter les tables en Parquet, partitionnées par année et par département
+    if repertoire_parquet:
+        debut = time.perf_counter()
+        exporter_annee(db_name, repertoire_parquet, annee, taille_lot)
+        print(f"  {annee} export Parquet dans {repertoire_parquet} en {time.perf_counter() - debut:.1f} s")
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Importe les fichiers BAAC annuels (caract, lieux, usagers, vehicules) dans accidents_{annee}.db")
+    parser.add_argument('annees', nargs='*', type=int, default=list(range(2020, 2025)), help="années à importer (par défaut 2020 à 2024)")
+    parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT, help=f"lignes lues et écrites à la fois (par défaut {TAILLE_LOT})")
+    parser.add_argument('--processus', type=int, default=os.cpu_count(), help="nombre d'années importées en parallèle (par défaut : nombre de cœurs)")
+    parser.add_argument('--forcer', action='store_true', help="réimporter même si les fichiers sources n'ont pas changé")
+    parser.add_argument('--parquet', metavar='REPERTOIRE', help="exporter aussi les tables en Parquet dans ce répertoire (nécessite pyarrow)")
+    args = parser.parse_args()
 
+    # Une base par processus : les années sont indépendantes, sans concurrence d'écriture
+    debut = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(args.processus, len(args.annees)) or 1) as executor:
+        imports = {executor.submit(importer_annee, annee, args.taille_lot, args.forcer, args.parquet): annee for annee in args.annees}
+        for future in as_completed(imports):
+            annee = imports[future]
+            try:
+                if future.result():
+                    print(f"Données pour l'année {annee} importées avec succès dans {chemin_base(annee)}")
+                else:
+                    print(f"Données pour l'année {annee} inchangées, {chemin_base(annee)} conservée")
+            except FileNotFoundError as e:
+                print(f"Erreur: Fichier non trouvé pour l'année {annee}: {e}")
+            except Exception as e:
+                print(f"Erreur lors du traitement de l'année {annee}: {e}")
+    print(f"Import terminé en {time.perf_counter() - debut:.1f} s")
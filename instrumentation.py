@@ -0,0 +1,157 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+# Mesures des étapes d'une opération (analyse d'une commune, liste détaillée) : durée, lignes lues, plan des requêtes
+# SQLite et variation de la mémoire. Les mesures sont collectées dans le journal de l'opération en cours (contextvars),
+# sans rien changer aux signatures : hors d'un bloc instrumenter, etape et lire_requete ne mesurent rien.
+
+# Fichier JSON Lines où ajouter une ligne par opération mesurée (agrégeable entre sessions), s'il est défini
+FICHIER_METRIQUES = os.environ.get('FICHIER_METRIQUES')
+
+# Une ligne de journalisation par étape mesurée, écrite sur la sortie d'erreur si NIVEAU_JOURNAL_MESURES vaut INFO
+# (ou DEBUG) ; sans cette variable, seul FICHIER_METRIQUES conserve les mesures hors du panneau de débogage
+NIVEAU_JOURNAL_MESURES = os.environ.get('NIVEAU_JOURNAL_MESURES')
+
+journaliseur = logging.getLogger('routes_mortelles.mesures')
+if NIVEAU_JOURNAL_MESURES:
+    _gestionnaire = logging.StreamHandler()
+    _gestionnaire.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    journaliseur.addHandler(_gestionnaire)
+    journaliseur.setLevel(NIVEAU_JOURNAL_MESURES.upper())
+    journaliseur.propagate = False
+
+_journal_courant = contextvars.ContextVar('journal_courant', default=None)
+_verrou_fichier = threading.Lock()
+
+# tracemalloc est global au processus : il reste actif tant qu'une opération mesurant la mémoire est en cours
+# (plusieurs sessions à la fois), et n'est arrêté que s'il a été démarré ici
+_verrou_tracemalloc = threading.Lock()
+_utilisateurs_tracemalloc = 0
+_tracemalloc_demarre = False
+
+
+# Fonction pour démarrer le suivi de la mémoire pour une opération (tracemalloc.start au premier utilisateur)
+def _acquerir_tracemalloc():
+    global _utilisateurs_tracemalloc, _tracemalloc_demarre
+    with _verrou_tracemalloc:
+        if _utilisateurs_tracemalloc == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_demarre = True
+        _utilisateurs_tracemalloc += 1
+
+
+# Fonction pour libérer le suivi de la mémoire (tracemalloc.stop au dernier utilisateur, s'il a été démarré ici)
+def _liberer_tracemalloc():
+    global _utilisateurs_tracemalloc, _tracemalloc_demarre
+    with _verrou_tracemalloc:
+        _utilisateurs_tracemalloc -= 1
+        if _utilisateurs_tracemalloc == 0 and _tracemalloc_demarre:
+            tracemalloc.stop()
+            _tracemalloc_demarre = False
+
+
+# Journal des mesures d'une opération
+class JournalMesures:
+    def __init__(self, operation, memoire=False, **contexte):
+        self.operation = operation
+        self.memoire = memoire
+        self.contexte = contexte
+        self.etapes = []
+        self.profondeur = 0
+        self.duree = None
+
+    def scans_complets(self):
+        # Requêtes dont le plan parcourt une table entière
+        return [etape for etape in self.etapes if etape.get('scans')]
+
+    def tableau(self):
+        colonnes = ['etape', 'type', 'profondeur', 'duree_ms', 'lignes', 'memoire_ko', 'scans', 'plan']
+        tableau = pd.DataFrame(self.etapes).reindex(columns=colonnes)
+        tableau['etape'] = ['  ' * profondeur + etape for profondeur, etape in zip(tableau['profondeur'], tableau['etape'])]
+        for colonne in ('scans', 'plan'):
+            tableau[colonne] = tableau[colonne].map(lambda details: '\n'.join(details) if isinstance(details, list) else '')
+        return tableau.drop(columns='profondeur')
+
+    def en_dict(self):
+        return {'operation': self.operation, 'date': time.time(), 'duree_ms': self.duree, **self.contexte, 'etapes': self.etapes}
+
+
+# Bloc mesurant une opération : renvoie son journal (None si actif vaut False), écrit en fin d'opération une ligne de
+# journalisation par étape et, si FICHIER_METRIQUES est défini, une ligne JSON dans ce fichier
+# (memoire : suivre la mémoire avec tracemalloc, ce qui ralentit l'opération)
+@contextmanager
+def instrumenter(operation, actif=True, memoire=False, **contexte):
+    if not actif:
+        yield None
+        return
+    mesures = JournalMesures(operation, memoire, **contexte)
+    if memoire:
+        _acquerir_tracemalloc()
+    jeton = _journal_courant.set(mesures)
+    debut = time.perf_counter()
+    try:
+        yield mesures
+    finally:
+        mesures.duree = (time.perf_counter() - debut) * 1000
+        _journal_courant.reset(jeton)
+        if memoire:
+            _liberer_tracemalloc()
+        enregistrer(mesures)
+
+
+# Fonction pour journaliser les mesures d'une opération et les ajouter au fichier de métriques
+def enregistrer(mesures):
+    for etape in mesures.etapes:
+        journaliseur.info(json.dumps({'operation': mesures.operation, **mesures.contexte, **etape}, ensure_ascii=False, default=str))
+    if FICHIER_METRIQUES:
+        ligne = json.dumps(mesures.en_dict(), ensure_ascii=False, default=str)
+        with _verrou_fichier, open(FICHIER_METRIQUES, 'a', encoding='utf-8') as f:
+            f.write(ligne + '\n')
+
+
+# Bloc mesurant une étape de l'opération en cours ; renvoie la mesure, que l'appelant peut compléter (ex. 'lignes')
+@contextmanager
+def etape(nom, type_etape='etape'):
+    mesures = _journal_courant.get()
+    if mesures is None:
+        yield {}
+        return
+    mesure = {'etape': nom, 'type': type_etape, 'profondeur': mesures.profondeur}
+    mesures.etapes.append(mesure)
+    mesures.profondeur += 1
+    memoire_debut = tracemalloc.get_traced_memory()[0] if mesures.memoire else None
+    debut = time.perf_counter()
+    try:
+        yield mesure
+    finally:
+        mesure['duree_ms'] = (time.perf_counter() - debut) * 1000
+        if memoire_debut is not None:
+            mesure['memoire_ko'] = (tracemalloc.get_traced_memory()[0] - memoire_debut) / 1024
+        mesures.profondeur -= 1
+
+
+# Fonction pour obtenir le plan d'une requête et les tables qu'il parcourt entièrement (SCAN sans index)
+def plan_requete(conn, requete, params):
+    details = [ligne[-1] for ligne in conn.execute(f'EXPLAIN QUERY PLAN {requete}', params)]
+    scans = [detail for detail in details
+             if detail.startswith('SCAN ') and ' INDEX ' not in detail and 'subquery' not in detail
+             and detail != 'SCAN CONSTANT ROW']
+    return details, scans
+
+
+# Fonction pour exécuter une requête dans un DataFrame, mesurée comme une étape de l'opération en cours
+def lire_requete(nom, requete, conn, params=()):
+    with etape(nom, 'requete') as mesure:
+        resultat = pd.read_sql_query(requete, conn, params=params)
+    # Le plan est demandé hors de la durée mesurée (la mesure est vide hors d'un bloc instrumenter)
+    if mesure:
+        mesure['lignes'] = len(resultat)
+        mesure['plan'], mesure['scans'] = plan_requete(conn, requete, params)
+    return resultat
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from base_donnees import GestionnaireConnexions, chemin_base
+from communes import IndexCommunes
+from donnees_synthetiques import ACCIDENTS_PAR_AN, GRAINE, generer
+from import_donnees import TAILLE_LOT, importer_annee
+from moteur_analyse import mettre_en_forme_victimes
+from rapport_commune import analyser_accidents_commune, exporter_csv, lire_page
+from stockage_parquet import SourceParquet, exporter_annee
+
+# Mesures de performance de l'import et de l'analyse sur un jeu de données synthétique fixe (donnees_synthetiques.py) :
+# latences (percentiles) et pic de mémoire de chaque scénario, enregistrés en JSON pour comparer deux versions
+
+FICHIER_COMMUNES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'v_commune_2024.csv')
+ANNEES = [2022, 2023, 2024]
+REPETITIONS = 20
+REPERTOIRE_PARQUET = 'parquet'
+PERCENTILES = [50, 90, 99]
+
+# Écart relatif au-delà duquel un scénario est signalé lors d'une comparaison
+SEUIL_REGRESSION = 0.10
+
+
+# Fonction pour exécuter une fonction plusieurs fois et mesurer ses durées, puis son pic de mémoire (tracemalloc,
+# sur une exécution supplémentaire pour ne pas fausser les durées)
+def mesurer(fonction, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    tracemalloc.start()
+    try:
+        fonction()
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    resultat = {'repetitions': repetitions, 'moyenne_s': float(np.mean(durees)), 'max_s': max(durees)}
+    resultat.update({f'p{p}_s': float(np.percentile(durees, p)) for p in PERCENTILES})
+    resultat['pic_memoire_octets'] = pic
+    return resultat
+
+
+# Fonction pour choisir les communes mesurées dans la base d'une année : la plus accidentée (hors villes à
+# arrondissements), une commune peu accidentée, une ville à arrondissements et la commune ayant le plus de communes enfants
+def choisir_communes(index_communes, annee):
+    conn = sqlite3.connect(chemin_base(annee))
+    try:
+        comptes = conn.execute('SELECT com, COUNT(*) AS n FROM caract GROUP BY com ORDER BY n DESC, com').fetchall()
+    finally:
+        conn.close()
+    indices = {code: i for i, code in enumerate(index_communes.codes) if index_communes.typecoms[i] == 'COM'}
+    typecoms = dict(zip(index_communes.codes, index_communes.typecoms))
+    communes_comptees = [code for code, _ in comptes if code in indices and code not in index_communes.enfants]
+    parents = [code for code in index_communes.enfants if code in indices]
+    arrondissements = [code for code in parents if typecoms[index_communes.enfants[code][0]] == 'ARM']
+    deleguees = [code for code in parents if code not in arrondissements]
+    return {
+        'grande_commune': indices[communes_comptees[0]],
+        'petite_commune': indices[communes_comptees[len(communes_comptees) * 3 // 4]],
+        'ville_arrondissements': indices[max(arrondissements, key=lambda code: len(index_communes.enfants[code]))],
+        'commune_parente': indices[max(deleguees, key=lambda code: len(index_communes.enfants[code]))],
+    }
+
+
+# Fonction pour vérifier que les sources SQLite et Parquet donnent les mêmes rapports et les mêmes CSV
+# Renvoie la liste des cas (commune, période, sortie) qui diffèrent
+def verifier_sources(index_communes, communes, annees, connexions, source_parquet):
+    differences = []
+    periodes = [[annee] for annee in annees] + ([annees] if len(annees) > 1 else [])
+    for nom, i in communes.items():
+        nom_commune, codes_insee = index_communes.nom(i), index_communes.codes_insee(i)
+        for periode in periodes:
+            if (analyser_accidents_commune(connexions, nom_commune, codes_insee, periode)
+                    != analyser_accidents_commune(source_parquet, nom_commune, codes_insee, periode)):
+                differences.append((nom, periode, 'rapport'))
+            if exporter_csv(connexions, codes_insee, periode) != exporter_csv(source_parquet, codes_insee, periode):
+                differences.append((nom, periode, 'csv'))
+    return differences
+
+
+# Fonction pour lancer tous les scénarios dans le répertoire de travail courant
+# (avec parquet à True, les scénarios d'analyse sont aussi mesurés sur l'export Parquet, suffixés _parquet)
+def lancer(annees, accidents, graine, repetitions, parquet=False):
+    resultats = {}
+
+    debut = time.perf_counter()
+    generer(annees, '.', accidents, graine, FICHIER_COMMUNES)
+    print(f"Données synthétiques générées en {time.perf_counter() - debut:.1f} s")
+
+    # Import : une seule exécution par année (chaque import reconstruit entièrement la base)
+    for annee in annees:
+        resultats[f'import_{annee}'] = mesurer(lambda: importer_annee(annee, forcer=True), 1)
+        print(f"  import {annee} : {resultats[f'import_{annee}']['moyenne_s']:.2f} s")
+        if parquet:
+            resultats[f'export_parquet_{annee}'] = mesurer(lambda: exporter_annee(chemin_base(annee), REPERTOIRE_PARQUET, annee, TAILLE_LOT), 1)
+
+    index_communes = IndexCommunes.depuis_fichier(FICHIER_COMMUNES)
+    communes = choisir_communes(index_communes, annees[-1])
+    connexions = GestionnaireConnexions()
+    sources = {'': connexions, '_parquet': SourceParquet(REPERTOIRE_PARQUET)} if parquet else {'': connexions}
+    if parquet:
+        differences = verifier_sources(index_communes, communes, annees, connexions, sources['_parquet'])
+        if differences:
+            raise RuntimeError(f"Les sources SQLite et Parquet diffèrent : {differences}")
+        print("  Rapports et CSV identiques entre SQLite et Parquet")
+    scenarios = {}
+    for suffixe, source in sources.items():
+        for nom, i in communes.items():
+            nom_commune, codes_insee = index_communes.nom(i), index_communes.codes_insee(i)
+            scenarios[f'analyse_{nom}{suffixe}'] = (
+                lambda s=source, n=nom_commune, c=codes_insee: analyser_accidents_commune(s, n, c, annees[-1:]))
+            scenarios[f'analyse_{nom}_{len(annees)}_ans{suffixe}'] = (
+                lambda s=source, n=nom_commune, c=codes_insee: analyser_accidents_commune(s, n, c, annees))
+            scenarios[f'page_victimes_{nom}{suffixe}'] = (
+                lambda s=source, c=codes_insee: mettre_en_forme_victimes(lire_page(s, c, annees)).to_markdown())
+            scenarios[f'export_csv_{nom}{suffixe}'] = lambda s=source, c=codes_insee: exporter_csv(s, c, annees)
+    for nom, fonction in scenarios.items():
+        fonction()  # première exécution (connexions, cache de pages) non mesurée
+        resultats[nom] = mesurer(fonction, repetitions)
+        print(f"  {nom} : p50 {resultats[nom]['p50_s'] * 1000:.1f} ms, p99 {resultats[nom]['p99_s'] * 1000:.1f} ms")
+    connexions.fermer()
+    return resultats, {nom: index_communes.codes[i] for nom, i in communes.items()}
+
+
+# Fonction pour comparer des résultats à une mesure de référence (rapport des p50)
+def comparer(resultats, reference):
+    for nom, mesure in resultats.items():
+        if nom not in reference:
+            continue
+        rapport = mesure['p50_s'] / max(reference[nom]['p50_s'], 1e-12)
+        signal = ' ← régression' if rapport > 1 + SEUIL_REGRESSION else ' ← amélioration' if rapport < 1 - SEUIL_REGRESSION else ''
+        print(f"  {nom} : {rapport:.2f} × la référence{signal}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mesure les performances de l'import et de l'analyse sur des données synthétiques")
+    parser.add_argument('annees', nargs='*', type=int, default=ANNEES, help=f"années générées (par défaut {ANNEES})")
+    parser.add_argument('--accidents', type=int, default=ACCIDENTS_PAR_AN, help=f"accidents par an (par défaut {ACCIDENTS_PAR_AN})")
+    parser.add_argument('--graine', type=int, default=GRAINE, help=f"graine du générateur (par défaut {GRAINE})")
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS, help=f"exécutions par scénario (par défaut {REPETITIONS})")
+    parser.add_argument('--resultats', default='resultats_performances.json', help="fichier JSON des résultats")
+    parser.add_argument('--reference', help="fichier JSON d'une mesure précédente, à comparer")
+    parser.add_argument('--parquet', action='store_true', help="mesurer aussi l'export et l'analyse Parquet (nécessite pyarrow)")
+    parser.add_argument('--repertoire', help="répertoire de travail (par défaut : répertoire temporaire supprimé à la fin)")
+    args = parser.parse_args()
+
+    fichier_resultats = os.path.abspath(args.resultats)
+    reference = None
+    if args.reference:
+        with open(args.reference, encoding='utf-8') as f:
+            reference = json.load(f)['resultats']
+
+    # Les bases et les fichiers sources sont lus dans le répertoire courant
+    repertoire_initial = os.getcwd()
+    with tempfile.TemporaryDirectory() as repertoire_temporaire:
+        repertoire = args.repertoire or repertoire_temporaire
+        os.makedirs(repertoire, exist_ok=True)
+        os.chdir(repertoire)
+        try:
+            resultats, communes = lancer(sorted(args.annees), args.accidents, args.graine, args.repetitions, args.parquet)
+        finally:
+            os.chdir(repertoire_initial)
+
+    mesure = {
+        'parametres': {'annees': sorted(args.annees), 'accidents': args.accidents, 'graine': args.graine,
+                       'repetitions': args.repetitions, 'parquet': args.parquet, 'communes': communes},
+        'environnement': {'python': sys.version.split()[0], 'plateforme': platform.platform(),
+                          'sqlite': sqlite3.sqlite_version, 'processeurs': os.cpu_count()},
+        # Pic de mémoire résidente du processus sur toute la mesure (Kio sous Linux)
+        'pic_memoire_processus': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'resultats': resultats,
+    }
+    with open(fichier_resultats, 'w', encoding='utf-8') as f:
+        json.dump(mesure, f, indent=2, ensure_ascii=False)
+    print(f"Résultats enregistrés dans {fichier_resultats}")
+    if reference is not None:
+        print("Comparaison avec la référence :")
+        comparer(resultats, reference)
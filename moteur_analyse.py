@@ -0,0 +1,312 @@
+import pandas as pd
+from base_donnees import requete_toutes_annees, schemas_connexion
+from instrumentation import lire_requete
+
+# Dictionnaire de regroupement des catégories (catv)
+catv_groupes = {
+    # Automobilistes (VL, VU)
+    '03': 'Automobiliste', '07': 'Automobiliste', '10': 'Automobiliste',
+
+    # Poids-lourds (PL, Tracteurs)
+    '13': 'Poids-lourd', '14': 'Poids-lourd', '15': 'Poids-lourd',
+    '16': 'Poids-lourd', '17': 'Poids-lourd',
+
+    # Vélo (y compris VAE)
+    '01': 'Vélo (incl. VAE)', '80': 'Vélo (incl. VAE)',
+    '02': '2RM', '30': '2RM', '31': '2RM', '32': '2RM', '33': '2RM', '34': '2RM',
+    '37': 'Bus/Car', '38': 'Bus/Car',
+
+    # Autres
+    '00': 'Autres', '04': 'Autres', '05': 'Autres', '06': 'Autres', '08': 'Autres', '09': 'Autres',
+    '11': 'Autres', '12': 'Autres', '18': 'Autres', '19': 'Autres', '20': 'Autres', '21': 'Autres',
+    '35': 'Autres', '36': 'Autres', '39': 'Autres', '40': 'Autres', '41': 'Autres', '42': 'Autres',
+    '43': 'Autres', '50': 'Autres', '60': 'Autres', '99': 'Autres',
+}
+
+# Table de correspondance précompilée catv (entier, tel que stocké dans les bases) → groupe
+GROUPES_PAR_CATV = pd.Series({int(catv): groupe for catv, groupe in catv_groupes.items()})
+
+# Groupes de véhicules, chacun associé à un bit : les groupes d'un accident se combinent en un masque
+GROUPES_VEHICULES = sorted(set(catv_groupes.values()))
+BITS_GROUPES = {groupe: 1 << rang for rang, groupe in enumerate(GROUPES_VEHICULES)}
+
+# Libellé "véhicules impliqués" de chaque masque (groupes triés par ordre alphabétique)
+LIBELLES_MASQUES = pd.Series({
+    masque: ', '.join(groupe for groupe in GROUPES_VEHICULES if masque & BITS_GROUPES[groupe]) or "Aucun véhicule"
+    for masque in range(1 << len(GROUPES_VEHICULES))
+})
+
+# Catégories de véhicules considérées comme des vélos
+CATV_VELO = [1, 80]
+
+# Âge en dessous duquel une victime est comptée comme enfant
+AGE_MAX_ENFANT = 18
+
+# Requête unique : une ligne par couple (victime piétonne ou conductrice, véhicule de l'accident)
+# ({schema} désigne la base de l'année, la requête est répétée en UNION ALL pour plusieurs années)
+REQUETE_VICTIMES_VEHICULES = '''
+SELECT
+    c.Num_Acc,
+    c.com,
+    c.an AS annee,
+    c.mois AS mois,
+    c.jour AS jour,
+    c.hrmn,
+    c.adr AS adresse,
+    c.lat AS latitude,
+    c.long AS longitude,
+    u.rowid AS id_ligne,
+    u.id_usager AS id_victime,
+    u.num_veh,
+    u.catu,
+    u.grav AS gravite,
+    u.an_nais,
+    v.num_veh AS v_num_veh,
+    v.catv
+FROM {schema}.caract c
+JOIN {schema}.usagers u ON u.Num_Acc = c.Num_Acc
+LEFT JOIN {schema}.vehicules v ON v.Num_Acc = c.Num_Acc
+WHERE {filtre_communes}u.grav != 1 AND u.catu IN (1, 3)
+'''
+
+
+# Fonction pour regrouper les catégories de véhicules
+def grouper_catv(df):
+    # Regroupe les catégories de véhicules d'un DataFrame selon le dictionnaire catv_groupes et trie par nombre décroissant.
+    # S'assurer que le DataFrame n'est pas vide avant de tenter le regroupement
+    if df.empty:
+        return pd.DataFrame({'Mode_Transport': [], 'nombre': []})
+
+    df = df.assign(Mode_Transport=groupes_catv(df['catv']))
+    df_groupes = df.groupby('Mode_Transport')['nombre'].sum().reset_index()
+    return df_groupes.sort_values(by='nombre', ascending=False)
+
+
+# Fonction pour obtenir le groupe de chaque catégorie de véhicules d'une série (catégorie inconnue : 'Autres')
+def groupes_catv(catv):
+    return pd.to_numeric(catv, errors='coerce').map(GROUPES_PAR_CATV).fillna('Autres')
+
+
+# Fonction pour charger en une seule requête toutes les lignes victime × véhicule des communes demandées
+# (de toutes les communes si codes_insee vaut None)
+def charger_lignes(conn, codes_insee=None):
+    if codes_insee is None:
+        filtre_communes, params = '', []
+    else:
+        # Requête paramétrée : le texte ne dépend que du nombre de codes, SQLite réutilise la requête compilée
+        filtre_communes = f"c.com IN ({', '.join('?' * len(codes_insee))}) AND "
+        params = [str(code_insee) for code_insee in codes_insee]
+    requete, params = requete_toutes_annees(conn, REQUETE_VICTIMES_VEHICULES, params, filtre_communes=filtre_communes)
+    lignes = lire_requete('lignes_victimes_vehicules', requete, conn, params)
+    # catv vaut NULL pour les victimes sans véhicule : garder des entiers plutôt que des flottants
+    lignes['catv'] = lignes['catv'].astype('Int64')
+    return lignes
+
+
+# Compteurs précalculés par commune (table stats_commune), pour les piétons puis les cyclistes
+COLONNES_STATISTIQUES = [
+    f'{usager}_{compteur}'
+    for usager in ('pietons', 'cyclistes')
+    for compteur in ('victimes', 'tues', 'hospitalises', 'legers', 'enfants')
+]
+
+REQUETE_STATISTIQUES = '''
+SELECT * FROM {schema}.stats_commune WHERE com IN ({marqueurs})
+'''
+
+REQUETE_STATISTIQUES_VEHICULES = '''
+SELECT annee, com, usager, catv, nombre FROM {schema}.stats_vehicules WHERE com IN ({marqueurs})
+'''
+
+
+# Fonction pour compter, par année et par commune, les victimes par gravité et les enfants
+def agreger_victimes(df, usager):
+    indicateurs = pd.DataFrame({
+        'annee': df['annee'],
+        'com': df['com'],
+        f'{usager}_victimes': 1,
+        f'{usager}_tues': (df['gravite'] == 2).astype(int),
+        f'{usager}_hospitalises': (df['gravite'] == 3).astype(int),
+        f'{usager}_legers': (df['gravite'] == 4).astype(int),
+        # Enfant : né après l'année de l'accident moins AGE_MAX_ENFANT
+        f'{usager}_enfants': (df['an_nais'] > df['annee'] - AGE_MAX_ENFANT).astype(int),
+    })
+    return indicateurs.groupby(['annee', 'com']).sum()
+
+
+# Fonction pour calculer, par année et par commune, tous les compteurs du rapport à partir des lignes chargées
+# Renvoie les compteurs (annee, com, compteurs...) et les véhicules impliqués (annee, com, usager, catv, nombre)
+def calculer_statistiques(lignes):
+    # Une victime est identifiée par son accident et sa ligne dans usagers (rowid, unique dans la base d'une année)
+    victimes = lignes.drop_duplicates(['Num_Acc', 'id_ligne'])
+    pietons = victimes[victimes['catu'] == 3]
+    lignes_pietons = lignes[(lignes['catu'] == 3) & lignes['catv'].notna()]
+
+    # Cycliste : conducteur (catu = 1) d'un vélo, une ligne par véhicule vélo correspondant à son num_veh
+    velos = lignes[(lignes['catu'] == 1) & (lignes['v_num_veh'] == lignes['num_veh']) & lignes['catv'].isin(CATV_VELO)]
+    # Véhicules tiers : autres véhicules de l'accident, comptés une fois par vélo du cycliste
+    tiers = lignes[(lignes['catu'] == 1) & lignes['v_num_veh'].notna() & lignes['num_veh'].notna()
+                   & (lignes['v_num_veh'] != lignes['num_veh'])]
+    multiplicite = velos.groupby(['Num_Acc', 'id_ligne']).size().rename('multiplicite').reset_index()
+    tiers = tiers.merge(multiplicite, on=['Num_Acc', 'id_ligne'])
+
+    statistiques = pd.concat([agreger_victimes(pietons, 'pietons'), agreger_victimes(velos, 'cyclistes')], axis=1)
+    statistiques = statistiques.reindex(columns=COLONNES_STATISTIQUES).fillna(0).astype(int).reset_index()
+
+    vehicules_pietons = lignes_pietons.groupby(['annee', 'com', 'catv']).size().reset_index(name='nombre')
+    vehicules_cyclistes = tiers.groupby(['annee', 'com', 'catv'])['multiplicite'].sum().reset_index(name='nombre')
+    vehicules = pd.concat([vehicules_pietons.assign(usager='pietons'), vehicules_cyclistes.assign(usager='cyclistes')],
+                          ignore_index=True)
+    return statistiques, vehicules[['annee', 'com', 'usager', 'catv', 'nombre']]
+
+
+# Fonction pour lire les compteurs précalculés des communes demandées (None si la base n'a pas de table stats_commune)
+def lire_statistiques(conn, codes_insee):
+    for schema in schemas_connexion(conn):
+        existe = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'stats_commune'").fetchone()
+        if existe is None:
+            return None
+    marqueurs = ', '.join('?' * len(codes_insee))
+    params = [str(code_insee) for code_insee in codes_insee]
+    requete, params_annees = requete_toutes_annees(conn, REQUETE_STATISTIQUES, params, marqueurs=marqueurs)
+    statistiques = lire_requete('statistiques_communes', requete, conn, params_annees)
+    requete, params_annees = requete_toutes_annees(conn, REQUETE_STATISTIQUES_VEHICULES, params, marqueurs=marqueurs)
+    vehicules = lire_requete('statistiques_vehicules', requete, conn, params_annees)
+    return statistiques, vehicules
+
+
+# Fonction pour additionner les compteurs de plusieurs communes (ex. une ville et ses arrondissements)
+def totaliser_statistiques(statistiques, vehicules):
+    totaux = statistiques.reindex(columns=COLONNES_STATISTIQUES).sum()
+
+    def compteurs(usager):
+        return {
+            'total_victimes': int(totaux[f'{usager}_victimes']),
+            'tues': int(totaux[f'{usager}_tues']),
+            'hospitalises': int(totaux[f'{usager}_hospitalises']),
+            'legers': int(totaux[f'{usager}_legers']),
+        }
+
+    def vehicules_par_catv(usager):
+        df = vehicules[vehicules['usager'] == usager]
+        if df.empty:
+            return pd.DataFrame({'catv': [], 'nombre': []})
+        return df.groupby('catv')['nombre'].sum().reset_index()
+
+    return {
+        'pietons': compteurs('pietons'),
+        'cyclistes': compteurs('cyclistes'),
+        'enfants_pietons': int(totaux['pietons_enfants']),
+        'enfants_cyclistes': int(totaux['cyclistes_enfants']),
+        'vehicules_pietons': vehicules_par_catv('pietons'),
+        'vehicules_cyclistes': vehicules_par_catv('cyclistes'),
+    }
+
+
+# Fonction pour construire le tableau d'évolution année par année des compteurs
+def evolution_par_annee(statistiques, annees):
+    evolution = statistiques.groupby('annee')[COLONNES_STATISTIQUES].sum().reindex(annees, fill_value=0)
+    evolution = evolution[['pietons_victimes', 'pietons_tues', 'pietons_hospitalises', 'pietons_enfants',
+                           'cyclistes_victimes', 'cyclistes_tues', 'cyclistes_hospitalises', 'cyclistes_enfants']]
+    evolution.columns = ['Piétons', 'Piétons tués', 'Piétons hospitalisés', 'Piétons enfants',
+                         'Cyclistes', 'Cyclistes tués', 'Cyclistes hospitalisés', 'Cyclistes enfants']
+    evolution.index.name = 'Année'
+    return evolution
+
+
+# Liste détaillée des victimes : piétons, et conducteurs d'un accident impliquant un vélo, servie page par page
+# (pagination par clé sur date, Num_Acc et ligne dans usagers), avec le masque des groupes de véhicules de l'accident
+REQUETE_LISTE_VICTIMES = '''
+SELECT
+    c.an AS annee,
+    c.mois AS mois,
+    c.jour AS jour,
+    u.grav AS gravite,
+    CASE WHEN u.catu = 3 THEN 'Piéton' ELSE 'Cycliste' END AS type_usager,
+    c.Num_Acc,
+    u.rowid AS id_ligne,
+    c.adr AS adresse,
+    c.lat AS latitude,
+    c.long AS longitude,
+    u.id_usager AS id_victime,
+    (SELECT SUM(DISTINCT {bit_catv}) FROM {schema}.vehicules v
+     WHERE v.Num_Acc = c.Num_Acc AND v.catv IS NOT NULL) AS masque_vehicules
+FROM {schema}.caract c
+JOIN {schema}.usagers u ON u.Num_Acc = c.Num_Acc
+WHERE c.com IN ({marqueurs}) AND u.grav != 1 AND (u.catu = 3 OR (u.catu = 1 AND EXISTS (
+    SELECT 1 FROM {schema}.vehicules v
+    WHERE v.Num_Acc = u.Num_Acc AND v.catv IN ({catv_velo})
+)))
+'''
+
+REQUETE_PAGE_VICTIMES = '''
+SELECT * FROM (
+{requete}
+)
+WHERE (annee, mois, jour, Num_Acc, id_ligne) > (?, ?, ?, ?, ?)
+ORDER BY annee, mois, jour, Num_Acc, id_ligne
+LIMIT ?
+'''
+
+# Clé de tri de la liste détaillée, et clé précédant la première victime
+CLE_LISTE_VICTIMES = ['annee', 'mois', 'jour', 'Num_Acc', 'id_ligne']
+CURSEUR_INITIAL = (0, 0, 0, 0, 0)
+
+TAILLE_PAGE = 100
+
+# Bit du groupe de chaque catégorie de véhicules, en SQL (catégorie inconnue : 'Autres')
+EXPRESSION_BIT_CATV = ('CASE v.catv '
+                       + ' '.join(f'WHEN {catv} THEN {BITS_GROUPES[groupe]}' for catv, groupe in GROUPES_PAR_CATV.items())
+                       + f" ELSE {BITS_GROUPES['Autres']} END")
+
+# Dictionnaire des gravités
+grav_dict = {1: 'Indemne', 2: 'Tué', 3: 'Blessé hospitalisé', 4: 'Blessé léger'}
+
+# Colonnes de la liste détaillée mise en forme (la latitude et la longitude ne sont pas affichées, seulement exportées)
+COLONNES_LISTE_VICTIMES = {
+    'Num_Acc': 'ID Accident',
+    'date_accident': 'Date',
+    'type_usager': 'Type usager',
+    'gravite_libelle': 'Gravité',
+    'vehicules_impliques': 'Véhicules impliqués',
+    'adresse': 'Localisation',
+    'latitude': 'Latitude',
+    'longitude': 'Longitude',
+}
+
+
+# Fonction pour lire une page de la liste détaillée, à partir de la clé de la dernière victime de la page précédente
+def lire_page_victimes(conn, codes_insee, curseur=CURSEUR_INITIAL, taille_page=TAILLE_PAGE):
+    marqueurs = ', '.join('?' * len(codes_insee))
+    catv_velo = ', '.join(str(catv) for catv in CATV_VELO)
+    requete, params = requete_toutes_annees(conn, REQUETE_LISTE_VICTIMES, [str(code_insee) for code_insee in codes_insee],
+                                            marqueurs=marqueurs, bit_catv=EXPRESSION_BIT_CATV, catv_velo=catv_velo)
+    page = lire_requete('page_victimes', REQUETE_PAGE_VICTIMES.format(requete=requete), conn,
+                        params + list(curseur) + [taille_page])
+    return completer_page_victimes(page)
+
+
+# Fonction pour ajouter à une page lue les libellés des véhicules impliqués et la date de l'accident
+def completer_page_victimes(page):
+    page['vehicules_impliques'] = page['masque_vehicules'].fillna(0).astype(int).map(LIBELLES_MASQUES)
+    page['date_accident'] = page['annee'].astype(str) + '-' + page['mois'].astype(str).str.zfill(2) + '-' + page['jour'].astype(str).str.zfill(2)
+    return page
+
+
+# Fonction pour obtenir la clé de la dernière victime d'une page (curseur de la page suivante)
+def curseur_suivant(page):
+    return tuple(int(valeur) for valeur in page[CLE_LISTE_VICTIMES].iloc[-1])
+
+
+# Fonction pour fusionner des pages lues sur plusieurs connexions (lots d'années) en une seule page triée
+def fusionner_pages(pages, taille_page=TAILLE_PAGE):
+    non_vides = [page for page in pages if not page.empty]
+    if len(non_vides) <= 1:
+        return non_vides[0] if non_vides else pages[0]
+    return pd.concat(non_vides, ignore_index=True).sort_values(CLE_LISTE_VICTIMES).head(taille_page).reset_index(drop=True)
+
+
+# Fonction pour mettre en forme une page de la liste détaillée (colonnes affichées et exportées en CSV)
+def mettre_en_forme_victimes(page):
+    page = page.assign(gravite_libelle=page['gravite'].map(grav_dict))
+    return page.reindex(columns=list(COLONNES_LISTE_VICTIMES)).rename(columns=COLONNES_LISTE_VICTIMES)
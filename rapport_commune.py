@@ -0,0 +1,146 @@
+import pandas as pd
+from base_donnees import decouper_annees
+from instrumentation import etape
+from moteur_analyse import (COLONNES_LISTE_VICTIMES, CURSEUR_INITIAL, TAILLE_PAGE, calculer_statistiques, charger_lignes,
+                            curseur_suivant, evolution_par_annee, fusionner_pages, grouper_catv, lire_page_victimes,
+                            lire_statistiques, mettre_en_forme_victimes, totaliser_statistiques)
+from stockage_parquet import SourceParquet
+
+# Rapport d'une commune, indépendant de l'interface Streamlit : les fonctions reçoivent le gestionnaire de connexions
+# (base_donnees.GestionnaireConnexions) à utiliser, partagé par les sessions de l'application ou propre à un processus
+# du générateur de rapports en lot, ou une source Parquet (stockage_parquet.SourceParquet), qui produit le même rapport
+
+
+# Fonction pour normaliser une année ou une plage d'années en liste triée
+def lister_annees(annees):
+    return [annees] if isinstance(annees, int) else sorted(annees)
+
+
+# Fonction pour obtenir le libellé d'une période : 2024, ou 2020-2024
+def libelle_periode(annees):
+    annees = lister_annees(annees)
+    return str(annees[0]) if len(annees) == 1 else f"{annees[0]}-{annees[-1]}"
+
+
+# Fonction pour charger les statistiques de plusieurs années
+# (bases annuelles attachées à une même connexion et interrogées en UNION ALL)
+def charger_statistiques(connexions, codes_insee, annees):
+    if isinstance(connexions, SourceParquet):
+        lignes = connexions.charger_lignes(codes_insee, lister_annees(annees))
+        with etape('calcul_statistiques'):
+            return calculer_statistiques(lignes)
+    statistiques, vehicules = [], []
+    for lot in decouper_annees(lister_annees(annees)):
+        with connexions.connexion(lot) as conn:
+            # Compteurs lus dans les statistiques précalculées à l'import (une ligne par code INSEE et par année) ;
+            # à défaut (bases importées sans statistiques), ils sont déduits des lignes victime × véhicule
+            statistiques_lot = lire_statistiques(conn, codes_insee)
+            if statistiques_lot is None:
+                lignes = charger_lignes(conn, codes_insee)
+                with etape('calcul_statistiques'):
+                    statistiques_lot = calculer_statistiques(lignes)
+        statistiques.append(statistiques_lot[0])
+        vehicules.append(statistiques_lot[1])
+    with etape('concatenation_annees'):
+        return pd.concat(statistiques, ignore_index=True), pd.concat(vehicules, ignore_index=True)
+
+
+# Fonction pour lire une page de la liste détaillée des victimes, triée par date, après le curseur donné
+def lire_page(connexions, codes_insee, annees, curseur=CURSEUR_INITIAL, taille_page=TAILLE_PAGE):
+    if isinstance(connexions, SourceParquet):
+        return connexions.lire_page(codes_insee, lister_annees(annees), curseur, taille_page)
+    pages = []
+    for lot in decouper_annees(lister_annees(annees)):
+        with connexions.connexion(lot) as conn:
+            pages.append(lire_page_victimes(conn, codes_insee, curseur, taille_page))
+    with etape('fusion_pages'):
+        return fusionner_pages(pages, taille_page)
+
+
+# Fonction pour extraire les accidents par date, page par page
+def extraire_accidents_par_date(connexions, codes_insee, annees, taille_page=TAILLE_PAGE):
+    if isinstance(connexions, SourceParquet):
+        # Les victimes sont lues et triées une fois pour toutes les pages, plutôt qu'à chaque page
+        yield from connexions.lire_pages(codes_insee, lister_annees(annees), taille_page)
+        return
+    curseur = CURSEUR_INITIAL
+    while True:
+        with etape('lecture_page') as mesure:
+            page = lire_page(connexions, codes_insee, annees, curseur, taille_page)
+        if mesure:
+            mesure['lignes'] = len(page)
+        if page.empty:
+            return
+        yield page
+        if len(page) < taille_page:
+            return
+        curseur = curseur_suivant(page)
+
+
+# Fonction pour produire le CSV de la liste détaillée, construit page par page à partir de la requête
+# (l'en-tête seul si la commune n'a aucune victime sur la période)
+def exporter_csv(connexions, codes_insee, annees):
+    morceaux = [pd.DataFrame(columns=list(COLONNES_LISTE_VICTIMES.values())).to_csv(index=False)]
+    for page in extraire_accidents_par_date(connexions, codes_insee, annees, taille_page=10 * TAILLE_PAGE):
+        with etape('mise_en_forme_csv'):
+            morceaux.append(mettre_en_forme_victimes(page).to_csv(index=False, header=False))
+    return ''.join(morceaux).encode('utf-8')
+
+
+# Fonction pour analyser les accidents d'une commune, sur une année ou une plage d'années
+def analyser_accidents_commune(connexions, nom_commune, codes_insee, annees):
+    annees = lister_annees(annees)
+    periode = libelle_periode(annees)
+    with etape('chargement_statistiques'):
+        statistiques_communes = charger_statistiques(connexions, codes_insee, annees)
+    with etape('totalisation'):
+        statistiques = totaliser_statistiques(*statistiques_communes)
+    pietons = statistiques['pietons']
+    cyclistes = statistiques['cyclistes']
+    total_enfants_victimes_pietons = statistiques['enfants_pietons']
+    total_enfants_victimes_cyclistes = statistiques['enfants_cyclistes']
+    total_enfants_victimes = total_enfants_victimes_pietons + total_enfants_victimes_cyclistes
+    with etape('regroupement_vehicules'):
+        vehicules_pietons_groupes = grouper_catv(statistiques['vehicules_pietons'])
+        vehicules_cyclistes_groupes = grouper_catv(statistiques['vehicules_cyclistes'])
+    # Générer le rapport consolidé
+    pietons_blesses_intro = pietons['total_victimes']
+    cyclistes_blesses_intro = cyclistes['total_victimes']
+    total_blesses_intro = pietons_blesses_intro + cyclistes_blesses_intro
+    rapport = f"""
+## Analyse des accidents routiers {periode} pour la commune de {nom_commune}
+{f'En {periode}' if len(annees) == 1 else f'De {annees[0]} à {annees[-1]}'}, **{total_blesses_intro} personne{'s' if total_blesses_intro > 1  else ''}** à pied ou à vélo dont **{total_enfants_victimes} enfant{'s' if total_enfants_victimes > 1 else ''}** {'ont' if total_blesses_intro > 1 else 'a'} été blessée{'s' if total_blesses_intro > 1  else ''} ou tuée{'s' if total_blesses_intro > 1  else ''} dans la ville :\n\n
+🔵 **{pietons_blesses_intro} piéton{'s' if pietons_blesses_intro > 1  else ''}** (dont **{total_enfants_victimes_pietons} enfant{'s' if total_enfants_victimes_pietons > 1  else ''}**)\n\n
+🔵 **{cyclistes_blesses_intro} cycliste{'s' if cyclistes_blesses_intro > 1  else ''}** (dont **{total_enfants_victimes_cyclistes} enfant{'s' if total_enfants_victimes_cyclistes > 1  else ''}**)
+## 🚶 Piétonnes et Piétons :
+{'Parmi les' if pietons_blesses_intro > 1  else ''} **{pietons_blesses_intro}** piétonne{'s et' if total_blesses_intro > 1  else ' ou'} piéton{'s' if pietons_blesses_intro > 1  else ''} blessé·e{'s' if pietons_blesses_intro > 1  else ''} ou tué·e{'s' if pietons_blesses_intro > 1  else ''} dans {'des' if pietons_blesses_intro > 1 else 'un'} accident{'s' if pietons_blesses_intro > 1  else ''}, **{pietons['hospitalises']}** {'ont' if pietons['hospitalises'] > 1  else 'a'} été hospitalisé·e{'s' if pietons['hospitalises'] > 1  else ''}
+    """
+    if pietons['tues'] > 0:
+        rapport += f", et **{pietons['tues']}** {'sont' if pietons['tues'] > 1  else 'est'} mort·e{'s' if pietons['tues'] > 1  else ''}.\n\n"
+    else:
+        rapport += ".\n\n"
+    rapport += "### Véhicules impliqués :\n\n"
+    if vehicules_pietons_groupes.empty:
+        rapport += "* Aucune collision avec des véhicules externes enregistrée.\n\n"
+    for _, row in vehicules_pietons_groupes.iterrows():
+        rapport += f"🔵 {row['nombre']} accident{'s' if row['nombre'] > 1  else ''} impliquant un **{row['Mode_Transport']}**\n\n"
+    rapport += f"""
+## 🚴 **Cyclistes** :
+{'Parmi les' if cyclistes_blesses_intro > 1  else ''} **{cyclistes_blesses_intro}** cycliste{'s' if cyclistes_blesses_intro > 1  else ''} blessé·e{'s' if cyclistes_blesses_intro > 1  else ''} ou tué·e{'s' if cyclistes_blesses_intro > 1  else ''} dans {'des' if cyclistes_blesses_intro > 1 else 'un'} accident{'s' if cyclistes_blesses_intro > 1  else ''}, **{cyclistes['hospitalises']}** {'ont' if cyclistes['hospitalises'] > 1  else 'a'} été hospitalisé·e{'s' if cyclistes['hospitalises'] > 1  else ''}
+    """
+    if cyclistes['tues'] > 0:
+        rapport += f", et **{cyclistes['tues']}** {'sont' if cyclistes['tues'] > 1  else 'est'} mort·e{'s' if cyclistes['tues'] > 1  else ''}.\n\n"
+    else:
+        rapport += "\n\n"
+    rapport += "### Véhicules impliqués :\n\n"
+    if vehicules_cyclistes_groupes.empty:
+        rapport += "- Aucune collision avec des véhicules externes enregistrée (victimes uniquement auto-accidentées ou indemnes).\n\n"
+    else:
+        for _, row in vehicules_cyclistes_groupes.iterrows():
+            rapport += f"🔵 {row['nombre']} accident{'s' if row['nombre'] > 1  else ''} impliquant un **{row['Mode_Transport']}**\n\n"
+    # Tableau d'évolution année par année pour une plage d'années
+    if len(annees) > 1:
+        rapport += "## 📈 Évolution par année :\n\n"
+        with etape('evolution_markdown'):
+            rapport += evolution_par_annee(statistiques_communes[0], annees).to_markdown() + "\n\n"
+    return rapport
@@ -0,0 +1,201 @@
+import bisect
+import os
+import shutil
+import sqlite3
+import threading
+import pandas as pd
+from instrumentation import etape
+from moteur_analyse import (BITS_GROUPES, CATV_VELO, CLE_LISTE_VICTIMES, CURSEUR_INITIAL, TAILLE_PAGE,
+                            completer_page_victimes, groupes_catv)
+
+# pyarrow n'est nécessaire que pour le stockage Parquet (import_donnees.py --parquet, generer_rapports.py --parquet)
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = ds = None
+
+# Tables exportées, une arborescence {repertoire}/{table}/annee=AAAA/departement=DD/ par table
+TABLES = ['caract', 'lieux', 'usagers', 'vehicules']
+
+# Colonnes écrites avec un encodage par dictionnaire (peu de valeurs distinctes, très répétées)
+COLONNES_DICTIONNAIRE = ['com', 'catu', 'grav', 'catv']
+
+# Département d'un code INSEE (trois caractères pour l'outre-mer), en SQL pour l'export
+EXPRESSION_DEPARTEMENT = "CASE WHEN c.com LIKE '97%' THEN substr(c.com, 1, 3) ELSE substr(c.com, 1, 2) END"
+
+# Export d'une table d'une base annuelle, avec le département de l'accident (et la ligne dans usagers, id_ligne)
+REQUETE_EXPORT = '''
+SELECT {id_ligne}t.*, {departement} AS departement
+FROM "{table}" t
+JOIN caract c ON c.Num_Acc = t.Num_Acc
+WHERE c.com IS NOT NULL
+'''
+
+
+# Fonction pour vérifier que pyarrow est installé
+def verifier_pyarrow():
+    if pa is None:
+        raise ImportError("Le stockage Parquet nécessite pyarrow (pip install pyarrow)")
+
+
+# Fonction pour obtenir le département d'un code INSEE (ex. 75056 → 75, 2A004 → 2A, 97411 → 974)
+def departement_commune(code_insee):
+    code_insee = str(code_insee)
+    return code_insee[:3] if code_insee.startswith('97') else code_insee[:2]
+
+
+# Fonction pour obtenir le partitionnement des tables : année puis département (répertoires clé=valeur)
+def partitionnement():
+    return ds.partitioning(pa.schema([('annee', pa.int16()), ('departement', pa.string())]), flavor='hive')
+
+
+# Fonction pour obtenir le répertoire des données d'une table pour une année
+def repertoire_annee(repertoire, table, annee):
+    return os.path.join(repertoire, table, f'annee={annee}')
+
+
+# Fonction pour vérifier si les quatre tables d'une année ont été exportées
+def annee_presente(repertoire, annee):
+    return all(os.path.isdir(repertoire_annee(repertoire, table, annee)) for table in TABLES)
+
+
+# Fonction pour obtenir le schéma Arrow d'une table à partir des types déclarés dans la base
+def schema_table(conn, table):
+    champs = [('id_ligne', pa.int64())] if table == 'usagers' else []
+    for _, nom, type_sql, *_ in conn.execute(f'PRAGMA table_info("{table}")'):
+        champs.append((nom, pa.int64() if type_sql.upper().startswith('INTEGER') else pa.string()))
+    champs.append(('departement', pa.string()))
+    return pa.schema(champs)
+
+
+# Fonction pour exporter en Parquet les quatre tables d'une base annuelle, lues par lots
+# Chaque table est écrite dans un répertoire caché puis renommé, les lecteurs ne voient jamais une année incomplète
+def exporter_annee(db_name, repertoire, annee, taille_lot):
+    verifier_pyarrow()
+    # Les lots sont lus par le fil d'exécution d'écriture de pyarrow, pas par celui qui a ouvert la connexion
+    conn = sqlite3.connect(db_name, check_same_thread=False)
+    try:
+        for table in TABLES:
+            schema = schema_table(conn, table)
+            requete = REQUETE_EXPORT.format(table=table, departement=EXPRESSION_DEPARTEMENT,
+                                            id_ligne='t.rowid AS id_ligne, ' if table == 'usagers' else '')
+            types_entiers = {champ.name: 'Int64' for champ in schema if pa.types.is_integer(champ.type)}
+            lots = (pa.RecordBatch.from_pandas(lot, schema=schema, preserve_index=False)
+                    for lot in pd.read_sql_query(requete, conn, chunksize=taille_lot, dtype=types_entiers))
+            dictionnaire = [colonne for colonne in COLONNES_DICTIONNAIRE if colonne in schema.names]
+            destination = repertoire_annee(repertoire, table, annee)
+            temporaire = os.path.join(repertoire, table, f'.annee={annee}.tmp')
+            shutil.rmtree(temporaire, ignore_errors=True)
+            ds.write_dataset(
+                lots, temporaire, schema=schema, format='parquet',
+                partitioning=ds.partitioning(pa.schema([('departement', pa.string())]), flavor='hive'),
+                file_options=ds.ParquetFileFormat().make_write_options(use_dictionary=dictionnaire, compression='zstd'),
+                basename_template='part-{i}.parquet', existing_data_behavior='overwrite_or_ignore',
+            )
+            shutil.rmtree(destination, ignore_errors=True)
+            os.replace(temporaire, destination)
+    finally:
+        conn.close()
+
+
+# Source de données Parquet pour les rapports, équivalente aux bases annuelles SQLite : seules les colonnes et les
+# partitions (année, département) nécessaires sont lues, le filtre sur les communes est appliqué à la lecture
+class SourceParquet:
+    def __init__(self, repertoire):
+        verifier_pyarrow()
+        self.repertoire = repertoire
+        self._datasets = {}
+        self._verrou = threading.Lock()
+
+    def annees(self):
+        repertoire = os.path.join(self.repertoire, 'caract')
+        if not os.path.isdir(repertoire):
+            return []
+        annees = (nom.removeprefix('annee=') for nom in os.listdir(repertoire) if nom.startswith('annee='))
+        return sorted(int(annee) for annee in annees if annee_presente(self.repertoire, annee))
+
+    def _dataset(self, table):
+        # Découverte des fichiers d'une table faite une fois (recréer la source après un nouvel export)
+        with self._verrou:
+            if table not in self._datasets:
+                self._datasets[table] = ds.dataset(os.path.join(self.repertoire, table), format='parquet',
+                                                   partitioning=partitionnement())
+            return self._datasets[table]
+
+    def _lire(self, table, colonnes, annees, codes_insee, filtre):
+        departements = sorted({departement_commune(code_insee) for code_insee in codes_insee})
+        filtre = ds.field('annee').isin(list(annees)) & ds.field('departement').isin(departements) & filtre
+        with etape(f'parquet_{table}', 'requete') as mesure:
+            resultat = self._dataset(table).to_table(columns=colonnes, filter=filtre).to_pandas()
+        if mesure:
+            mesure['lignes'] = len(resultat)
+        return resultat
+
+    def _lire_victimes(self, codes_insee, annees, filtre_accidents=None):
+        # Accidents des communes (filtrés aussi par filtre_accidents s'il est donné), puis leurs victimes piétonnes ou
+        # conductrices (hors indemnes) et leurs véhicules
+        codes_insee = [str(code_insee) for code_insee in codes_insee]
+        filtre = ds.field('com').isin(codes_insee)
+        if filtre_accidents is not None:
+            filtre = filtre & filtre_accidents
+        caract = self._lire('caract', ['Num_Acc', 'com', 'an', 'mois', 'jour', 'hrmn', 'adr', 'lat', 'long'],
+                            annees, codes_insee, filtre)
+        accidents = caract['Num_Acc'].tolist()
+        usagers = self._lire('usagers', ['Num_Acc', 'id_ligne', 'id_usager', 'num_veh', 'catu', 'grav', 'an_nais'],
+                             annees, codes_insee, ds.field('Num_Acc').isin(accidents) & (ds.field('grav') != 1)
+                             & ds.field('catu').isin([1, 3]))
+        vehicules = self._lire('vehicules', ['Num_Acc', 'num_veh', 'catv'], annees, codes_insee,
+                               ds.field('Num_Acc').isin(accidents))
+        victimes = caract.merge(usagers, on='Num_Acc').rename(columns={
+            'an': 'annee', 'adr': 'adresse', 'lat': 'latitude', 'long': 'longitude',
+            'id_usager': 'id_victime', 'grav': 'gravite',
+        })
+        return victimes, vehicules
+
+    # Équivalent de moteur_analyse.charger_lignes : une ligne par couple (victime, véhicule de l'accident)
+    def charger_lignes(self, codes_insee, annees):
+        victimes, vehicules = self._lire_victimes(codes_insee, annees)
+        lignes = victimes.merge(vehicules.rename(columns={'num_veh': 'v_num_veh'}), on='Num_Acc', how='left')
+        lignes = lignes.reindex(columns=['Num_Acc', 'com', 'annee', 'mois', 'jour', 'hrmn', 'adresse', 'latitude', 'longitude',
+                                         'id_ligne', 'id_victime', 'num_veh', 'catu', 'gravite', 'an_nais', 'v_num_veh', 'catv'])
+        return lignes.assign(catv=lignes['catv'].astype('Int64'))
+
+    # Victimes de la liste détaillée dont la clé suit le curseur, triées par clé ; la date du curseur est appliquée à la
+    # lecture, les années et les jours qui le précèdent ne sont pas lus
+    def _victimes_liste(self, codes_insee, annees, curseur):
+        annee, mois, jour = curseur[:3]
+        filtre_date = ((ds.field('an') > annee) | ((ds.field('an') == annee) & (
+            (ds.field('mois') > mois) | ((ds.field('mois') == mois) & (ds.field('jour') >= jour)))))
+        victimes, vehicules = self._lire_victimes(codes_insee, [a for a in annees if a >= annee], filtre_date)
+        accidents_velo = vehicules.loc[vehicules['catv'].isin(CATV_VELO), 'Num_Acc']
+        victimes = victimes[(victimes['catu'] == 3) | ((victimes['catu'] == 1) & victimes['Num_Acc'].isin(accidents_velo))]
+
+        # Masque des groupes de véhicules de chaque accident (somme des bits distincts)
+        vehicules = vehicules[vehicules['catv'].notna()]
+        bits = vehicules.assign(bit=groupes_catv(vehicules['catv']).map(BITS_GROUPES))[['Num_Acc', 'bit']]
+        masques = bits.drop_duplicates().groupby('Num_Acc')['bit'].sum().rename('masque_vehicules')
+
+        victimes = victimes.assign(type_usager=victimes['catu'].map({3: 'Piéton'}).fillna('Cycliste'))
+        victimes = victimes.join(masques, on='Num_Acc').sort_values(CLE_LISTE_VICTIMES).reset_index(drop=True)
+
+        # Pagination par clé, comme en SQL : victimes dont la clé suit celle du curseur
+        cles = list(victimes[CLE_LISTE_VICTIMES].itertuples(index=False, name=None))
+        return victimes.iloc[bisect.bisect_right(cles, tuple(curseur)):]
+
+    @staticmethod
+    def _mettre_en_page(victimes):
+        page = victimes.reset_index(drop=True)
+        page = page.reindex(columns=['annee', 'mois', 'jour', 'gravite', 'type_usager', 'Num_Acc', 'id_ligne', 'adresse',
+                                     'latitude', 'longitude', 'id_victime', 'masque_vehicules'])
+        return completer_page_victimes(page)
+
+    # Équivalent de moteur_analyse.lire_page_victimes, sur toutes les années demandées
+    def lire_page(self, codes_insee, annees, curseur=CURSEUR_INITIAL, taille_page=TAILLE_PAGE):
+        return self._mettre_en_page(self._victimes_liste(codes_insee, annees, curseur).iloc[:taille_page])
+
+    # Toutes les pages de la liste détaillée, lues et triées une seule fois (export CSV)
+    def lire_pages(self, codes_insee, annees, taille_page=TAILLE_PAGE):
+        victimes = self._victimes_liste(codes_insee, annees, CURSEUR_INITIAL)
+        for debut in range(0, len(victimes), taille_page):
+            yield self._mettre_en_page(victimes.iloc[debut:debut + taille_page])